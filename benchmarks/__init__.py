@@ -0,0 +1,4 @@
+"""
+Benchmarks of hass_mqtt. Run one of them from the repository root, e.g.,
+``python -m benchmarks.bench_topic``.
+"""
@@ -0,0 +1,46 @@
+"""
+Measure the command dispatch throughput of :py:meth:`hass_mqtt.Device.on_command`
+compared with splitting and decoding every command.
+"""
+import json
+import timeit
+
+from hass_mqtt import Device, Switch
+
+
+def split_dispatch(device: Device, msg):
+    """the former dispatch"""
+    key, msg = msg.split(b';')
+    key = key.decode()
+    target = device.components.get(key)
+    if target is not None:
+        target.write(msg)
+
+
+def bench(components=100, number=200000):
+    """
+    Run the benchmark
+
+    :param components: number of components of the device
+    :param number: number of commands
+    :return: a dict of results
+    """
+    device = Device().configure(serial_number='bench')
+    for i in range(components):
+        device.add_component(f'switch_{i}', Switch())
+    msg = f'switch_{components // 2};OFF'.encode()
+
+    result = {'components': components, 'number': number}
+    cases = (
+        ('split', lambda: split_dispatch(device, msg)),
+        ('table', lambda: device.on_command(msg)),
+        ('table_malformed', lambda: device.on_command(b'OFF')),
+    )
+    for name, func in cases:
+        seconds = min(timeit.repeat(func, number=number, repeat=3))
+        result[name] = {'seconds': seconds, 'commands_per_sec': number / seconds}
+    return result
+
+
+if __name__ == '__main__':
+    print(json.dumps(bench(), indent=2))
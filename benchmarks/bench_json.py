@@ -0,0 +1,68 @@
+"""
+Compare json backends of :py:mod:`hass_mqtt.serializer` on real discovery
+configs and state payloads, together with the former `json.dumps(...).encode()`.
+"""
+import json
+import timeit
+
+from hass_mqtt import Device, Switch, serializer
+from hass_mqtt.components import sensor
+
+
+def make_payloads(components=50):
+    """discovery data of components and the state of a device"""
+    device = Device().configure(name='Bench', serial_number='bench', manufacturer='me', model='bench')
+    for i in range(components):
+        device.add_component(f't_{i}', sensor.Temperature())
+        device.add_component(f'h_{i}', sensor.Humidity())
+        device.add_component(f's_{i}', Switch())
+    device.set_availability()
+    configs = []
+    for target in device.components.values():
+        data = dict(target.make_config_data())
+        data['object_id'] = target.unique_id
+        configs.append(data)
+    for i, target in enumerate(device.components.values()):
+        if not isinstance(target, Switch):
+            target.value = 20 + i / 7
+    return configs, dict(device.value)
+
+
+def bench(number=200, components=50):
+    """
+    Run the benchmark
+
+    :param number: rounds of encoding all configs and the state
+    :param components: number of components of each type
+    :return: a dict of results
+    """
+    configs, state = make_payloads(components)
+    state_bytes = json.dumps(state).encode()
+    config_bytes = [json.dumps(data).encode() for data in configs]
+    result = {'number': number, 'configs': len(configs), 'state_bytes': len(state_bytes)}
+    cases = [('legacy_json', lambda obj: json.dumps(obj).encode(), json.loads)]
+    for name, make in serializer.BACKENDS.items():
+        try:
+            cases.append((name, *make()))
+        except ImportError:
+            result[name] = None
+    for name, dumps, loads in cases:
+        def encode_configs(dumps=dumps):
+            for data in configs:
+                dumps(data)
+        config_seconds = min(timeit.repeat(encode_configs, number=number, repeat=3))
+        state_seconds = min(timeit.repeat(lambda dumps=dumps: dumps(state), number=number, repeat=3))
+        load_seconds = min(timeit.repeat(lambda loads=loads: loads(state_bytes), number=number, repeat=3))
+        result[name] = {
+            'configs_per_sec': number * len(configs) / config_seconds,
+            'states_per_sec': number / state_seconds,
+            'state_loads_per_sec': number / load_seconds,
+            'state_bytes': len(dumps(state)),
+            'config_bytes': sum(len(dumps(data)) for data in configs),
+        }
+    result['legacy_config_bytes'] = sum(len(data) for data in config_bytes)
+    return result
+
+
+if __name__ == '__main__':
+    print(json.dumps(bench(), indent=2))
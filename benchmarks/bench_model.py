@@ -0,0 +1,65 @@
+"""
+Measure reading :py:class:`hass_mqtt.Field` compared with the former
+implementation, and building discovery configs which read fields a lot.
+"""
+import json
+import timeit
+
+from hass_mqtt import Device, Model, Field, DefaultFactory
+from hass_mqtt.components import sensor
+
+
+class LegacyField(Field):
+    """the former way of reading a field"""
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        default = self.default
+        if isinstance(self.default, DefaultFactory):
+            default = default()
+        value = instance.data.setdefault(self.name, default)
+        return self.cast(value)
+
+
+class Fast(Model):
+    """model using Field"""
+    name = Field('name')
+    items = Field('items', DefaultFactory(list))
+
+
+class Legacy(Model):
+    """model using LegacyField"""
+    name = LegacyField('name')
+    items = LegacyField('items', DefaultFactory(list))
+
+
+def bench(number=500000, components=200):
+    """
+    Run the benchmark
+
+    :param number: number of field reads
+    :param components: number of components whose configs are built
+    :return: a dict of results
+    """
+    result = {'number': number}
+    for name, cls in (('legacy', Legacy), ('field', Fast)):
+        obj = cls({'name': 'bench'})
+        seconds = min(timeit.repeat(lambda obj=obj: (obj.name, obj.items), number=number, repeat=3))
+        result[name] = {'seconds': seconds, 'reads_per_sec': 2 * number / seconds}
+
+    def build():
+        device = Device().configure(serial_number='bench')
+        for i in range(components):
+            device.add_component(f't_{i}', sensor.Temperature())
+        device.set_availability()
+        for target in device.components.values():
+            target.make_config()
+
+    seconds = min(timeit.repeat(build, number=1, repeat=5))
+    result['build_configs'] = {'components': components, 'seconds': seconds}
+    return result
+
+
+if __name__ == '__main__':
+    print(json.dumps(bench(), indent=2))
@@ -0,0 +1,57 @@
+"""
+Compare the topic trie used by :py:meth:`hass_mqtt.MQTTClient.sub_cb` with
+a plain :py:class:`dict` lookup of exact topics.
+"""
+import json
+import timeit
+
+from hass_mqtt.topic import TopicTrie
+
+
+def make_topics(devices):
+    """make per-device command topics"""
+    return [f'device/serial_{i}/set'.encode() for i in range(devices)]
+
+
+def bench(devices=5000, wildcards=10, number=200000):
+    """
+    Run the benchmark
+
+    :param devices: number of exact topics
+    :param wildcards: number of wildcard filters
+    :param number: number of lookups
+    :return: a dict of results
+    """
+    topics = make_topics(devices)
+    table = {}
+    trie = TopicTrie()
+    for topic in topics:
+        cbs = table[topic] = [print]
+        trie.insert(topic, cbs)
+    exact_trie = TopicTrie()
+    for topic in topics:
+        exact_trie.insert(topic, table[topic])
+    for i in range(wildcards):
+        trie.insert(f'device/+/sensor_{i}/#'.encode(), [print])
+    trie.insert(b'device/#', [print])
+
+    hit = topics[devices // 2]
+
+    def dict_path():
+        table.get(hit, [])
+
+    def trie_exact():
+        exact_trie.match(hit)
+
+    def trie_mixed():
+        trie.match(hit)
+
+    result = {'devices': devices, 'wildcards': wildcards + 1, 'number': number}
+    for name, func in (('dict', dict_path), ('trie_exact_only', trie_exact), ('trie_with_wildcards', trie_mixed)):
+        seconds = min(timeit.repeat(func, number=number, repeat=3))
+        result[name] = {'seconds': seconds, 'lookups_per_sec': number / seconds}
+    return result
+
+
+if __name__ == '__main__':
+    print(json.dumps(bench(), indent=2))
@@ -0,0 +1,197 @@
+"""
+An in-process stand-in MQTT broker for benchmarks. It speaks just enough
+MQTT 3.1.1 for umqtt: CONNECT, SUBSCRIBE with several filters, PUBLISH with
+qos 0 and 1, PINGREQ and DISCONNECT. Retained messages and sessions are not
+supported.
+"""
+import socket
+import socketserver
+import threading
+
+from hass_mqtt.topic import TopicTrie
+from hass_mqtt.packet import PUBLISH, PUBACK, SUBSCRIBE, SUBACK, encode_length, encode_str
+
+CONNECT = 0x10
+CONNACK = 0x20
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+
+def recv_exact(sock, size):
+    """read exactly size bytes"""
+    buf = bytearray()
+    while len(buf) < size:
+        data = sock.recv(size - len(buf))
+        if not data:
+            raise ConnectionError('closed')
+        buf += data
+    return bytes(buf)
+
+
+def recv_packet(sock):
+    """read a packet and return (first byte, body)"""
+    header = recv_exact(sock, 1)[0]
+    size = 0
+    shift = 0
+    while True:
+        byte = recv_exact(sock, 1)[0]
+        size |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+    return header, recv_exact(sock, size)
+
+
+class Handler(socketserver.BaseRequestHandler):
+    """one client connection"""
+    server: 'Server'
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.lock = threading.Lock()
+        with self.server.broker.lock:
+            self.server.broker.handlers.add(self)
+
+    def send(self, data):
+        """send a packet"""
+        with self.lock:
+            self.request.sendall(data)
+
+    def handle(self):
+        broker = self.server.broker
+        try:
+            while True:
+                header, body = recv_packet(self.request)
+                kind = header & 0xF0
+                if kind == CONNECT:
+                    self.send(bytes((CONNACK, 2, 0, 0)))
+                elif kind == PUBLISH:
+                    broker.on_publish(self, header, body)
+                elif kind == SUBSCRIBE & 0xF0:
+                    self.on_subscribe(body)
+                elif kind == PINGREQ:
+                    self.send(bytes((PINGRESP, 0)))
+                elif kind == DISCONNECT:
+                    return
+        except (ConnectionError, OSError):
+            return
+        finally:
+            broker.drop(self)
+
+    def on_subscribe(self, body):
+        """handle SUBSCRIBE"""
+        pid = body[:2]
+        pos = 2
+        codes = bytearray()
+        while pos < len(body):
+            size = int.from_bytes(body[pos:pos + 2], 'big')
+            topic = body[pos + 2:pos + 2 + size]
+            pos += 2 + size + 1
+            self.server.broker.subscribe(topic, self)
+            codes.append(0)
+        self.send(bytes((SUBACK,)) + encode_length(2 + len(codes)) + pid + bytes(codes))
+
+    def on_puback(self, pid):
+        """acknowledge a qos 1 PUBLISH"""
+        self.send(bytes((PUBACK, 2)) + pid)
+
+
+class Server(socketserver.ThreadingTCPServer):
+    """TCP server of the broker"""
+    daemon_threads = True
+    allow_reuse_address = True
+    broker: 'FakeBroker'
+
+
+class FakeBroker:
+    """
+    Route PUBLISH packets to subscribed connections. Run it with
+    ``with FakeBroker() as broker:`` and connect to broker.port.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.server = Server((host, port), Handler)
+        self.server.broker = self
+        self.host, self.port = self.server.server_address
+        self.trie = TopicTrie()
+        self.subscriptions = {}
+        self.handlers = set()
+        self.lock = threading.Lock()
+        self.received = 0
+        self.received_event = threading.Event()
+        self.expected = None
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+        self.kick()
+
+    def kick(self):
+        """close all client connections, as a restart of the broker would"""
+        with self.lock:
+            handlers = list(self.handlers)
+        for handler in handlers:
+            try:
+                handler.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def subscribe(self, topic, handler):
+        """add a subscriber"""
+        with self.lock:
+            handlers = self.subscriptions.get(topic)
+            if handlers is None:
+                handlers = self.subscriptions[topic] = []
+                self.trie.insert(topic, handlers)
+            if handler not in handlers:
+                handlers.append(handler)
+
+    def drop(self, handler):
+        """remove a closed connection"""
+        with self.lock:
+            self.handlers.discard(handler)
+            for handlers in self.subscriptions.values():
+                if handler in handlers:
+                    handlers.remove(handler)
+
+    def expect(self, count):
+        """wait for count more PUBLISH packets by calling wait"""
+        with self.lock:
+            self.expected = self.received + count
+            self.received_event.clear()
+
+    def wait(self, timeout=30):
+        """wait for the expected PUBLISH packets"""
+        return self.received_event.wait(timeout)
+
+    def on_publish(self, sender, header, body):
+        """route a PUBLISH"""
+        size = int.from_bytes(body[:2], 'big')
+        topic = body[2:2 + size]
+        pos = 2 + size
+        qos = (header >> 1) & 3
+        if qos:
+            pid = body[pos:pos + 2]
+            pos += 2
+        msg = body[pos:]
+        with self.lock:
+            self.received += 1
+            if self.expected is not None and self.received >= self.expected:
+                self.received_event.set()
+            targets = [handler for handlers in self.trie.match(topic) for handler in handlers]
+        # forward with qos 0
+        packet = bytes((PUBLISH,)) + encode_length(len(topic) + 2 + len(msg)) + encode_str(topic) + msg
+        for handler in targets:
+            try:
+                handler.send(packet)
+            except OSError:
+                pass
+        if qos:
+            sender.on_puback(pid)
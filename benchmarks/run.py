@@ -0,0 +1,233 @@
+"""
+Run the benchmark suite against an in-process :py:class:`benchmarks.broker.FakeBroker`
+and print the results as json, e.g.,
+``python -m benchmarks.run --output results.json``.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import time
+
+from hass_mqtt import MQTTClient, MQTTInfo, Device, Switch
+from hass_mqtt.components import sensor
+
+from .broker import FakeBroker
+from . import bench_dispatch, bench_json, bench_model, bench_topic
+
+
+def make_client(broker, client_id):
+    """connect a client to the broker"""
+    info = MQTTInfo().prop('addr', broker.host).prop('port', broker.port).prop('client_id', client_id)
+    return MQTTClient(info).connect(clean_session=True)
+
+
+def make_device(client, components, serial_number='bench'):
+    """a device with some temperature sensors"""
+    device = Device(mqtt_client=client).configure(serial_number=serial_number)
+    for i in range(components):
+        device.add_component(f't_{i}', sensor.Temperature())
+    device.set_availability()
+    return device
+
+
+def bench_publish(broker, number):
+    """qos 0 publish throughput until the broker receives all messages"""
+    client = make_client(broker, 'bench-publish')
+    msg = b'{"t_0": 21.5}'
+    broker.expect(number)
+    start = time.perf_counter()
+    for _ in range(number):
+        client.publish(b'bench/publish', msg)
+    broker.wait()
+    seconds = time.perf_counter() - start
+    client.disconnect()
+    return {'number': number, 'seconds': seconds, 'msgs_per_sec': number / seconds}
+
+
+def bench_sub_cb(number, topics):
+    """dispatch rate of MQTTClient.sub_cb without network"""
+    client = MQTTClient()
+    for i in range(topics):
+        client.map[f'device/{i}/set'.encode()] = cbs = [lambda msg: None]
+        client.trie.insert(f'device/{i}/set'.encode(), cbs)
+    topic = f'device/{topics // 2}/set'.encode()
+    start = time.perf_counter()
+    for _ in range(number):
+        client.sub_cb(topic, b'ON')
+    seconds = time.perf_counter() - start
+    return {'number': number, 'topics': topics, 'seconds': seconds, 'msgs_per_sec': number / seconds}
+
+
+def bench_send_config(broker, components):
+    """time of Device.send_config"""
+    client = make_client(broker, 'bench-config')
+    device = make_device(client, components)
+    broker.expect(components)
+    start = time.perf_counter()
+    device.send_config()
+    broker.wait()
+    cold = time.perf_counter() - start
+    broker.expect(components)
+    start = time.perf_counter()
+    device.send_config()
+    broker.wait()
+    cached = time.perf_counter() - start
+    client.disconnect()
+    return {'components': components, 'cold_seconds': cold, 'cached_seconds': cached}
+
+
+def bench_push_state(components, number):
+    """encode cost of Device.push_state with one changing value"""
+    device = make_device(None, components)
+    target = device.components['t_0']
+    start = time.perf_counter()
+    for i in range(number):
+        target.value = i
+        device.encoder.encode(device.value)
+    seconds = time.perf_counter() - start
+    return {'components': components, 'number': number, 'seconds_per_push': seconds / number}
+
+
+def bench_publish_plan(broker, number):
+    """qos 0 publish throughput of a state topic with and without a precompiled plan"""
+    client = make_client(broker, 'bench-plan')
+    msg = b'{"t_0": 21.5}'
+    plan = client.compile_plan('bench/plan')
+    results = {'number': number}
+    for name, func in (('plain', lambda: client.publish('bench/plan', msg)),
+                       ('plan', lambda: client.publish_plan(plan, msg))):
+        broker.expect(number)
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        broker.wait()
+        results[f'{name}_msgs_per_sec'] = number / (time.perf_counter() - start)
+    client.disconnect()
+    return results
+
+
+def bench_sharded_push(broker, components, number):
+    """bytes and time of delta-mode pushes changing one value, with and without shards of 10%"""
+    shard_size = max(1, components // 10)
+    results = {'components': components, 'number': number, 'shard_size': shard_size}
+    for name, size in (('single', None), ('sharded', shard_size)):
+        client = make_client(broker, f'bench-{name}')
+        device = Device(mqtt_client=client).configure(serial_number=f'bench-{name}')
+        device.set_sharding(size)
+        for i in range(components):
+            device.add_component(f't_{i}', sensor.Temperature())
+        device.set_delta()
+        device.push_state()
+        before = client.metrics.totals()['bytes_out']
+        broker.expect(number)
+        start = time.perf_counter()
+        for i in range(number):
+            # always a change
+            device.components[f't_{i % components}'].value = 1000 + i
+            device.push_state()
+        broker.wait()
+        seconds = time.perf_counter() - start
+        results[name] = {
+            'seconds_per_push': seconds / number,
+            'bytes_per_push': (client.metrics.totals()['bytes_out'] - before) / number,
+        }
+        client.disconnect()
+    return results
+
+
+async def round_trips(device_client, sender, device, number):
+    """send commands and wait for them to be written"""
+    received = asyncio.Event()
+    target = device.components['switch']
+    target.set_writer(lambda msg: received.set(), blocking=False)
+    listener = asyncio.create_task(device_client.listen())
+    latencies = []
+    try:
+        for _ in range(number):
+            received.clear()
+            start = time.perf_counter()
+            sender.publish(device.command_topic, b'switch;ON')
+            await asyncio.wait_for(received.wait(), 5)
+            latencies.append(time.perf_counter() - start)
+        # let the last debounced state echo go out
+        await asyncio.sleep(2 * device.echo_delay)
+    finally:
+        listener.cancel()
+    return latencies
+
+
+def bench_round_trip(broker, number):
+    """latency from publishing a command to calling the writer"""
+    device_client = make_client(broker, 'bench-device')
+    sender = make_client(broker, 'bench-sender')
+    device = Device(mqtt_client=device_client).configure(serial_number='bench-rt')
+    device.add_component('switch', Switch())
+    device.subscribe()
+    latencies = asyncio.run(round_trips(device_client, sender, device, number))
+    device_client.disconnect()
+    sender.disconnect()
+    latencies.sort()
+    return {
+        'number': number,
+        'mean_seconds': statistics.mean(latencies),
+        'p50_seconds': latencies[len(latencies) // 2],
+        'p99_seconds': latencies[int(len(latencies) * 0.99)],
+        'echo_p50_seconds': device.echo_stats.latency.quantile(0.5),
+        'echo_p99_seconds': device.echo_stats.latency.quantile(0.99),
+        'echoes': device.echo_stats.count,
+    }
+
+
+def run(scale=1.0):
+    """
+    Run all benchmarks
+
+    :param scale: multiply the sizes of benchmarks
+    :return: a dict of results
+    """
+    def size(number):
+        return max(1, int(number * scale))
+
+    results = {
+        'meta': {
+            'time': time.time(),
+            'python': sys.version,
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+        },
+    }
+    with FakeBroker() as broker:
+        results['publish'] = bench_publish(broker, size(20000))
+        results['publish_plan'] = bench_publish_plan(broker, size(20000))
+        results['sharded_push'] = bench_sharded_push(broker, size(200), size(2000))
+        results['send_config'] = bench_send_config(broker, size(1000))
+        results['round_trip'] = bench_round_trip(broker, size(500))
+    results['sub_cb'] = bench_sub_cb(size(200000), size(5000))
+    results['push_state'] = bench_push_state(size(200), size(5000))
+    results['topic'] = bench_topic.bench(number=size(200000))
+    results['dispatch'] = bench_dispatch.bench(number=size(200000))
+    results['model'] = bench_model.bench(number=size(500000))
+    results['json'] = bench_json.bench(number=size(200))
+    return results
+
+
+def main():
+    """command line entry"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output', '-o', help='write json to a file instead of stdout')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply the sizes of benchmarks')
+    args = parser.parse_args()
+    results = run(args.scale)
+    text = json.dumps(results, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as file:
+            file.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 """
 A package for making HomeAssistant MQTT devices
 """
+__version__ = '0.1.0'
+
 from .model import *
 from .client import *
 from .device import Device
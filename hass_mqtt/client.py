@@ -9,18 +9,31 @@ except ImportError:
     import asyncio
 
 try:
-    import ujson as json
+    from time import monotonic
 except ImportError:
-    import json
+    from time import time as monotonic
+
+try:
+    from select import select
+except ImportError:
+    select = None
 
 
 try:
     from umqtt.robust import MQTTClient as _MQTTClient
+    from umqtt.simple import MQTTClient as _SimpleClient
 except ImportError as err:
     raise ImportError("Please refer to https://github.com/fduxiao/umqtt_python") from err
 
 
 from .model import Model, Field
+from .topic import TopicTrie
+from .outbox import Outbox
+from .executor import default_executor
+from .ratelimit import STATE
+from .packet import PUBACK, SUBACK, PublishPlan, publish_packet, subscribe_packet
+from . import serializer
+from .metrics import Metrics, now, topic_name
 
 
 class MQTTInfo(Model):
@@ -34,22 +47,58 @@ class MQTTInfo(Model):
     client_id = Field('client_id')
     username = Field('username')
     password = Field('password')
+    status_topic = Field('status_topic')
 
 
-class MQTTClient:
+class MQTTClient:  # pylint: disable=too-many-instance-attributes
     """
     This class wraps an MQTT client with an extra :py:class:`dict` called map.
-    On receiving a subscribed message, the class will search for a call list
-    in map using MQTT topic as the key. A decorator is provided to register
-    a callback easily.
+    On receiving a subscribed message, the class will search for call lists
+    whose topic filters match the MQTT topic. Filters, including those with
+    wildcards, are indexed by a :py:class:`TopicTrie`. A decorator is provided
+    to register a callback easily.
     """
     client: _MQTTClient
 
     def __init__(self, info: MQTTInfo = None, debug=False, keepalive=0, ssl=None) -> None:
+        # see hass_mqtt.profiling
+        self.tracer = None
+        # availability of the whole client, see set_status_topic
+        self.status_topic = None
+        self.status_qos = 0
         if info is not None:
             self.set_mqtt(info, debug, keepalive, ssl)
 
         self.map = {}  # dict literal
+        self.trie = TopicTrie()
+        self.last_sent = monotonic()
+        self.outbox = None
+        self.metrics = Metrics()
+        # the socket seen last time, used to detect reconnection
+        self.sock = None
+        # pipelined qos 1: packet id -> [topic, msg, retain, sent time]
+        self.window = 0
+        self.retry_timeout = 10
+        self.inflight = {}
+        self.window_space = asyncio.Event()
+        self.window_space.set()
+        # subscriptions: topic filters not sent yet and packet id -> filters waiting for SUBACK
+        self.unsent = []
+        self.pending_subacks = {}
+        self.rejected = []
+        self.holding = False
+        self.subscribe_batch = 64
+        self.subscribe_timeout = 10
+        # store and forward
+        self.connected = False
+        self.spool = None
+        self.drain_rate = 100
+        self.drain_batch = 50
+        self.retry_delay = 5
+        self.draining = None
+        # the event waited by listen, and packets read at most per wakeup
+        self.readable = None
+        self.read_batch = 64
 
     def set_mqtt(self, info: MQTTInfo, debug=False, keepalive=0, ssl=None):
         """
@@ -60,6 +109,8 @@ class MQTTClient:
         :param keepalive: keepalive seconds. 0 for always.
         :param ssl: ssl
         :return:
+
+        If `info.status_topic` is set, it is used as the last will, see :py:meth:`set_status_topic`.
         """
         self.client = _MQTTClient(
             info.client_id,
@@ -72,8 +123,45 @@ class MQTTClient:
         )
         self.client.DEBUG = debug
         self.client.set_callback(self.sub_cb)
+        if info.status_topic is not None:
+            self.set_status_topic(info.status_topic)
+        return self
+
+    def set_status_topic(self, topic, qos=0):
+        """
+        Publish a retained `online` to the topic on every (re)connect, and
+        register a retained `offline` as the last will, so that the broker
+        marks everything offline when the connection is lost without any
+        periodic traffic. Components added to devices afterwards require this
+        topic as well as their own availability. Call this before connecting
+        and building components.
+
+        :param topic: the status topic. None to disable.
+        :param qos: MQTT qos of the status messages
+        :return: self
+        """
+        self.status_topic = topic
+        self.status_qos = qos
+        if topic is not None:
+            self.client.set_last_will(topic, b'offline', True, qos)
         return self
 
+    def announce(self):
+        """
+        publish `online` to the status topic. It is written at once, ahead of
+        messages in the spool or the outbox, so that entities become available
+        again before the backlog is forwarded.
+        """
+        if self.status_topic is None:
+            return
+        try:
+            self.send(self.status_topic, b'online', True, self.status_qos)
+        except OSError:
+            if self.spool is not None:
+                self.lost()
+                return
+            self.reconnect()
+
     def connect(self, clean_session=False, return_result=False):
         """
         Connect to the MQTT broker
@@ -84,38 +172,176 @@ class MQTTClient:
             set return_result to True.
         """
         r = self.client.connect(clean_session=clean_session)
+        self.connected = True
+        if not self.check_reconnect():
+            self.resubscribe()
+            self.announce()
+        # messages stored by a previous run
+        self.start_draining()
         if return_result:
             return r
         return self
 
     def disconnect(self):
-        """disconnect"""
+        """disconnect. The last will is not sent on a clean disconnect, so `offline` is published here."""
+        if self.status_topic is not None:
+            self.client.publish(self.status_topic, b'offline', True, self.status_qos)
         return self.client.disconnect()
 
+    def check_reconnect(self):
+        """
+        Detect whether the robust client has reconnected with a new socket,
+        and call :py:meth:`reconnected` if so.
+
+        :return: whether reconnected or not
+        """
+        sock = self.client.sock
+        if sock is self.sock:
+            return False
+        first = self.sock is None
+        self.sock = sock
+        if first:
+            return False
+        self.reconnected()
+        return True
+
+    def reconnected(self):
+        """restore the session after a reconnection"""
+        self.resubscribe()
+        self.resend_inflight(force=True)
+        # the broker may have published the last will
+        self.announce()
+
+    def hold_subscriptions(self):
+        """
+        Only record subscriptions until :py:meth:`flush_subscriptions`, so that
+        they are sent together. Subscriptions made before connecting are always
+        held until connected.
+        """
+        self.holding = True
+        return self
+
+    def flush_subscriptions(self):
+        """
+        Send recorded subscriptions in SUBSCRIBE packets of up to subscribe_batch
+        filters, and wait for all SUBACKs after sending all packets, see
+        :py:meth:`wait_subacks`.
+
+        :return: self
+        """
+        self.holding = False
+        topics = self.unsent
+        self.unsent = []
+        batch = self.subscribe_batch
+        for i in range(0, len(topics), batch):
+            chunk = topics[i:i + batch]
+            pid = self.next_pid()
+            self.pending_subacks[pid] = chunk
+            try:
+                self.write(subscribe_packet(pid, chunk))
+            except OSError:
+                self.subscription_lost()
+                return self
+        self.wait_subacks()
+        return self
+
+    def subscription_lost(self):
+        """
+        The connection is lost while subscribing. All subscriptions are sent again
+        after reconnecting, at once by umqtt.robust, or by :py:meth:`restore` with a spool.
+
+        :return: whether all subscriptions are acknowledged
+        """
+        if self.spool is not None:
+            self.lost()
+            return False
+        self.reconnect()
+        return not self.pending_subacks
+
+    def wait_subacks(self, timeout=None):
+        """
+        Wait for pending SUBACKs at most timeout seconds. SUBACKs arriving later
+        are still handled by the receive loop. If the connection is lost meanwhile,
+        the old packet ids are never acknowledged, so the subscriptions are sent
+        again after reconnecting instead.
+
+        :param timeout: seconds. None for subscribe_timeout.
+        :return: whether all SUBACKs are received
+        """
+        if timeout is None:
+            timeout = self.subscribe_timeout
+        deadline = monotonic() + timeout
+        while self.pending_subacks:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return False
+            if not self.readable_within(remaining):
+                return False
+            try:
+                # umqtt.robust would wait on the new connection after reconnecting
+                self.handle_op(_SimpleClient.wait_msg(self.client))
+            except OSError:
+                return self.subscription_lost()
+        return True
+
+    def resubscribe(self):
+        """send all recorded subscriptions again, e.g., after a reconnection"""
+        self.pending_subacks = {}
+        self.unsent = list(self.map)
+        if self.unsent and not self.holding:
+            self.flush_subscriptions()
+        return self
+
     def wildcard_cb(self, topic, msg):
         """receive all messages regardless of topic"""
 
     def sub_cb(self, topic, msg):
         """callback of subscription"""
+        stats = self.metrics.topic(topic)
+        stats.count += 1
+        stats.bytes_in += len(msg)
         self.wildcard_cb(topic, msg)
-        cbs = self.map.get(topic, [])
-        for one in cbs:
-            one(msg)
+        latency = stats.latency
+        tracer = self.tracer
+        if tracer is not None:
+            name = f'dispatch {topic_name(topic)}'
+            token = tracer.enter(name)
+        try:
+            for cbs in self.trie.match(topic):
+                for one in cbs:
+                    start = now()
+                    try:
+                        one(msg)
+                    except Exception:
+                        stats.errors += 1
+                        raise
+                    latency.observe(now() - start)
+        finally:
+            if tracer is not None:
+                tracer.exit(name, token)
 
     def subscribe(self, topic, func=None):
         """
         Register a callback under some topic. If you provide func,
         then it is just registered. Otherwise, a decorator is return,
-        which receives the callback and registers it.
+        which receives the callback and registers it. A new topic is
+        recorded in map and sent by :py:meth:`flush_subscriptions`, at once
+        unless subscriptions are held or the client is not connected yet.
 
-        :param topic: target MQTT topic
+        :param topic: target MQTT topic filter, which may contain `+` or `#`
         :param func: callback function
         :return: self or a decorator
         """
         # always register self
         if isinstance(topic, str):
             topic = topic.encode()
-        self.client.subscribe(topic)
+        if topic not in self.map:
+            self.map[topic] = []
+            self.trie.insert(topic, self.map[topic])
+            self.unsent.append(topic)
+            # send at once unless held or not connected yet
+            if not self.holding and self.sock is not None:
+                self.flush_subscriptions()
 
         def decorator(real_f=None):
             """
@@ -127,7 +353,7 @@ class MQTTClient:
             # called as a decorator
             # then register real_f
             if real_f is not None:
-                cbs: list = self.map.setdefault(topic, [])
+                cbs: list = self.map[topic]
                 cbs.append(real_f)
             return real_f
 
@@ -136,20 +362,451 @@ class MQTTClient:
         decorator(func)
         return self
 
-    def publish(self, topic, msg, retain=False, qos=0):
-        """publish a message"""
+    def enable_outbox(self, maxsize=1024, batch_bytes=16384):
+        """
+        Queue qos 0 messages in an :py:class:`Outbox` instead of writing them
+        at once. Remember to run :py:meth:`Outbox.run` in background. If a write
+        fails, the queue is handed to the spool if any, or kept while umqtt.robust
+        reconnects. While the spool is in use, messages skip the outbox.
+
+        :param maxsize: maximum number of pending messages
+        :param batch_bytes: maximum bytes written at a time
+        :return: the outbox
+        """
+        self.outbox = Outbox(self, maxsize, batch_bytes)
+        return self.outbox
+
+    def set_rate_limit(self, rate, burst=None, topic_rate=None, topic_burst=None):
+        """
+        Limit the publish rate of qos 0 messages, enabling the outbox if needed.
+        Limited messages wait in the priority lanes of the outbox, see
+        :py:mod:`hass_mqtt.ratelimit`. Use :py:meth:`Outbox.set_topic_limit`
+        for limits of specific topics, and :py:meth:`Outbox.stats` for the
+        limits and the queue latency.
+
+        :param rate: messages per second of the client. None for no limit.
+        :param burst: messages allowed at once by the client
+        :param topic_rate: messages per second of each topic. None for no limit.
+        :param topic_burst: messages allowed at once per topic
+        :return: the outbox
+        """
+        outbox = self.outbox
+        if outbox is None:
+            outbox = self.enable_outbox()
+        outbox.set_limit(rate, burst)
+        outbox.set_topic_limit(topic_rate, topic_burst)
+        return outbox
+
+    def write(self, data):
+        """write raw bytes to the socket"""
+        sock = self.client.sock
+        write = getattr(sock, 'write', None)
+        if write is None:
+            write = sock.sendall
+        write(data)
+        self.last_sent = monotonic()
+
+    def write_buffers(self, buffers):
+        """write a list of buffers, in one system call if possible"""
+        sendmsg = getattr(self.client.sock, 'sendmsg', None)
+        if sendmsg is None:
+            for data in buffers:
+                self.write(data)
+            return
+        total = 0
+        for data in buffers:
+            total += len(data)
+        sent = sendmsg(buffers)
+        if sent < total:
+            self.write(b''.join(buffers)[sent:])
+        self.last_sent = monotonic()
+
+    @staticmethod
+    def compile_plan(topic, retain=False, qos=0, plan=None):
+        """
+        Make a :py:class:`PublishPlan` for :py:meth:`publish_plan`
+
+        :param topic: MQTT topic
+        :param retain: MQTT retain
+        :param qos: MQTT qos. Only qos 0 is compiled.
+        :param plan: a previous plan returned if still valid
+        :return: a plan, or None if the message cannot be planned
+        """
+        if qos != 0 or topic is None:
+            return None
+        if plan is not None and plan.matches(topic, retain, qos):
+            return plan
+        return PublishPlan(topic, retain)
+
+    def publish_plan(self, plan: PublishPlan, msg, coalesce=False, priority=STATE):
+        """
+        publish an encoded message with a precompiled plan. With an outbox or
+        a spool, this is the same as :py:meth:`publish`. If the socket is broken,
+        the message is published by umqtt.robust, which reconnects.
+        """
+        if self.outbox is not None or self.spool is not None:
+            return self.publish(plan.topic, msg, plan.retain, plan.qos, coalesce, priority)
+        stats = self.metrics.topic(plan.topic)
+        stats.messages_out += 1
+        stats.bytes_out += len(msg)
+        tracer = self.tracer
+        if tracer is not None:
+            name = f'publish {topic_name(plan.topic)}'
+            token = tracer.enter(name)
+        try:
+            self.write_buffers(plan.buffers(msg))
+        except OSError:
+            self.client.publish(plan.topic, msg, plan.retain, plan.qos)
+            self.last_sent = monotonic()
+            self.check_reconnect()
+        finally:
+            if tracer is not None:
+                tracer.exit(name, token)
+        return True
+
+    def publish(self, topic, msg, retain=False, qos=0, coalesce=False, priority=STATE):
+        """
+        publish a message
+
+        :param topic: MQTT topic
+        :param msg: bytes or anything json serializable
+        :param retain: MQTT retain
+        :param qos: MQTT qos
+        :param coalesce: with an outbox, only keep the latest pending message of the topic
+        :param priority: the lane in the outbox, see :py:mod:`hass_mqtt.ratelimit`
+        :return: False if the outbox is full and the message is dropped
+        """
+        tracer = self.tracer
+        if tracer is not None:
+            name = f'publish {topic_name(topic)}'
+            token = tracer.enter(name)
+        try:
+            if not isinstance(msg, bytes):
+                msg = serializer.dumps(msg)
+            stats = self.metrics.topic(topic)
+            stats.messages_out += 1
+            stats.bytes_out += len(msg)
+            if self.storing():
+                return self.forward(topic, msg, retain, qos)
+            if self.outbox is not None and qos == 0:
+                return self.outbox.put(topic, msg, retain, qos, coalesce, priority)
+            if self.spool is not None:
+                return self.forward(topic, msg, retain, qos)
+            if self.window and qos == 1:
+                self.wait_window()
+                self.send_inflight(topic, msg, retain)
+                return True
+            self.client.publish(topic, msg, retain, qos)
+            self.last_sent = monotonic()
+            return True
+        finally:
+            if tracer is not None:
+                tracer.exit(name, token)
+
+    async def apublish(self, topic, msg, retain=False, qos=0, coalesce=False, priority=STATE):
+        """Like :py:meth:`publish`, but wait while the outbox is full"""
+        if self.window and qos == 1:
+            while len(self.inflight) >= self.window:
+                self.window_space.clear()
+                await self.window_space.wait()
+            return self.publish(topic, msg, retain, qos, coalesce, priority)
+        if self.outbox is None or qos != 0 or self.storing():
+            return self.publish(topic, msg, retain, qos, coalesce, priority)
         if not isinstance(msg, bytes):
-            msg = json.dumps(msg)
-            msg = msg.encode()
-        self.client.publish(topic, msg, retain, qos)
+            msg = serializer.dumps(msg)
+        await self.outbox.put_wait(topic, msg, retain, qos, coalesce, priority)
+        return True
+
+    def enable_pipelining(self, window=32, retry_timeout=10):
+        """
+        Publish qos 1 messages without waiting for their PUBACK, keeping at most
+        window messages unacknowledged. PUBACKs are matched on the receive path,
+        i.e., :py:meth:`check_msg`, :py:meth:`loop` or :py:meth:`listen`.
+
+        :param window: maximum number of messages in flight
+        :param retry_timeout: seconds before resending an unacknowledged message
+        :return: self
+        """
+        self.window = window
+        self.retry_timeout = retry_timeout
+        return self
+
+    def next_pid(self):
+        """allocate a packet id, which is shared with umqtt"""
+        pid = self.client.pid
+        while True:
+            pid = pid % 65535 + 1
+            if pid not in self.inflight:
+                break
+        self.client.pid = pid
+        return pid
+
+    def send_inflight(self, topic, msg, retain=False):
+        """
+        publish a qos 1 message and keep it until acknowledged. If the socket is
+        broken, umqtt.robust reconnects and all messages in flight are resent.
+        """
+        pid = self.next_pid()
+        self.inflight[pid] = [topic, msg, retain, monotonic()]
+        try:
+            self.write(publish_packet(topic, msg, retain, 1, pid))
+        except OSError:
+            if self.spool is not None:
+                raise
+            self.reconnect()
+        return pid
+
+    def wait_window(self):
+        """
+        Block until the window of qos 1 messages has space. Messages unacknowledged
+        for retry_timeout seconds are resent meanwhile, and if the connection is
+        lost, umqtt.robust reconnects and the session is restored.
+        """
+        while len(self.inflight) >= self.window:
+            timeout = self.next_retry()
+            try:
+                if timeout <= 0:
+                    self.resend_inflight()
+                elif self.readable_within(timeout):
+                    self.handle_op(_SimpleClient.wait_msg(self.client))
+            except OSError:
+                self.reconnect()
+
+    def readable_within(self, timeout):
+        """
+        Wait at most timeout seconds for the socket to be readable. Without select,
+        or on a closed socket, this returns True at once and reading tells the rest.
+        """
+        if select is None:
+            return True
+        try:
+            return bool(select([self.client.sock], [], [], timeout)[0])
+        except ValueError:  # closed
+            return True
+
+    def resend_inflight(self, force=False):
+        """
+        Resend unacknowledged messages with the DUP flag
+
+        :param force: resend all of them rather than expired ones
+        :return: number of messages resent
+        """
+        if not self.inflight:
+            return 0
+        current = monotonic()
+        expired = current - self.retry_timeout
+        count = 0
+        for pid, entry in self.inflight.items():
+            topic, msg, retain, sent = entry
+            if force or sent <= expired:
+                entry[3] = current
+                self.write(publish_packet(topic, msg, retain, 1, pid, dup=True))
+                count += 1
+        return count
+
+    def next_retry(self):
+        """seconds until the next resend, or None if nothing is in flight"""
+        if not self.inflight:
+            return None
+        oldest = min(entry[3] for entry in self.inflight.values())
+        return oldest + self.retry_timeout - monotonic()
+
+    def read(self, size):
+        """read raw bytes from the socket"""
+        sock = self.client.sock
+        read = getattr(sock, 'read', None)
+        if read is not None:
+            return read(size)
+        data = b''
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise OSError(-1)
+            data += chunk
+        return data
+
+    def handle_op(self, op):
+        """
+        Finish reading a packet umqtt does not handle itself, whose first
+        byte is returned by wait_msg
+
+        :param op: the returned value of wait_msg
+        :return: op
+        """
+        if op == PUBACK:
+            data = self.read(3)
+            pid = data[1] << 8 | data[2]
+            if self.inflight.pop(pid, None) is not None and len(self.inflight) < self.window:
+                self.window_space.set()
+        elif op == SUBACK:
+            data = self.read(self.read_length())
+            pid = data[0] << 8 | data[1]
+            topics = self.pending_subacks.pop(pid, ())
+            for topic, code in zip(topics, data[2:]):
+                if code == 0x80:
+                    self.rejected.append(topic)
+        return op
+
+    def read_length(self):
+        """read the remaining length of a packet"""
+        size = 0
+        shift = 0
+        while True:
+            byte = self.read(1)[0]
+            size |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return size
+            shift += 7
+
+    def enable_spool(self, file_path, capacity=1 << 24, rate=100, batch=50, retry_delay=5):
+        """
+        Store messages in an on-disk :py:class:`hass_mqtt.spool.Spool` while the broker
+        is unreachable instead of blocking in the reconnection of umqtt.robust.
+        :py:meth:`loop` or :py:meth:`listen` then reconnects every retry_delay seconds
+        and forwards the stored messages in order.
+
+        :param file_path: path of the log file
+        :param capacity: bytes of the log. The oldest messages are dropped when full.
+        :param rate: maximum messages per second when forwarding stored messages
+        :param batch: messages forwarded at a time
+        :param retry_delay: seconds between two reconnection attempts
+        :return: the spool
+        """
+        # pylint: disable=import-outside-toplevel
+        from .spool import Spool
+        self.spool = Spool(file_path, capacity)
+        self.drain_rate = rate
+        self.drain_batch = batch
+        self.retry_delay = retry_delay
+        return self.spool
+
+    def storing(self):
+        """whether messages are stored in the spool, i.e., disconnected or stored messages are pending"""
+        spool = self.spool
+        return spool is not None and (not self.connected or len(spool) > 0)
+
+    def reconnect(self):
+        """reconnect with umqtt.robust, which blocks until connected, and restore the session"""
+        self.client.reconnect()
+        self.connected = True
+        self.check_reconnect()
+        return self
+
+    def lost(self):
+        """mark the connection as lost"""
+        self.connected = False
+        try:
+            self.client.sock.close()
+        except OSError:
+            pass
+        # wake up listen to reconnect
+        if self.readable is not None:
+            self.readable.set()
+
+    def send(self, topic, msg, retain=False, qos=0):
+        """write a PUBLISH without waiting, tracking qos 1 messages until acknowledged"""
+        if qos == 1:
+            self.send_inflight(topic, msg, retain)
+        else:
+            self.write(publish_packet(topic, msg, retain, qos))
+
+    def forward(self, topic, msg, retain=False, qos=0):
+        """publish a message, or store it if disconnected or stored messages are pending"""
+        spool = self.spool
+        if self.connected and not spool:
+            try:
+                self.send(topic, msg, retain, qos)
+                return True
+            except OSError:
+                self.lost()
+        return spool.append(topic, msg, retain, qos)
+
+    async def drain_spool(self):
+        """forward stored messages at the rate limit"""
+        spool = self.spool
+        while self.connected and len(spool):
+            for _ in range(self.drain_batch):
+                item = spool.peek()
+                if item is None:
+                    break
+                (topic, msg, retain, qos), size = item
+                try:
+                    self.send(topic, msg, retain, qos)
+                except OSError:
+                    self.lost()
+                    return
+                spool.advance(size)
+            await asyncio.sleep(self.drain_batch / self.drain_rate)
+
+    def start_draining(self):
+        """
+        Forward stored messages in background if there are some. Without a running
+        event loop, this is done once :py:meth:`loop` or :py:meth:`listen` starts.
+
+        :return: the task or None
+        """
+        if self.spool is None or not self.spool:
+            return None
+        if self.draining is not None and not self.draining.done():
+            return self.draining
+        coro = self.drain_spool()
+        try:
+            self.draining = asyncio.create_task(coro)
+        except RuntimeError:  # no running event loop
+            coro.close()
+            self.draining = None
+        return self.draining
+
+    async def restore(self):
+        """
+        Try to reconnect after retry_delay seconds and forward stored messages.
+        The connection is made in the shared thread pool, so the event loop is
+        not blocked while the broker is unreachable.
+
+        :return: whether reconnected or not
+        """
+        await asyncio.sleep(self.retry_delay)
+        try:
+            await default_executor.run(_SimpleClient.connect, self.client, False)
+        except OSError:
+            return False
+        self.connected = True
+        self.check_reconnect()
+        self.start_draining()
+        return True
+
+    def ping(self):
+        """send PINGREQ"""
+        try:
+            self.client.ping()
+        except OSError:
+            if self.spool is None:
+                raise
+            self.lost()
+        self.last_sent = monotonic()
 
     def check_msg(self):
         """Check whether we have a msg or not. This is non-blocking"""
-        return self.client.check_msg()
+        if self.spool is None:
+            return self.handle_op(self.client.check_msg())
+        # never block in the reconnection of umqtt.robust
+        if not self.connected:
+            return None
+        try:
+            self.client.sock.setblocking(False)
+            return self.handle_op(_SimpleClient.wait_msg(self.client))
+        except OSError:
+            self.lost()
+            return None
+
+    def pending(self):
+        """whether bytes are buffered in the socket, e.g., decrypted by ssl"""
+        pending = getattr(self.client.sock, 'pending', None)
+        return pending is not None and self.connected and pending() > 0
 
     def wait_msg(self):
         """Check whether we have a msg or not. This is blocking"""
-        return self.client.wait_msg()
+        return self.handle_op(self.client.wait_msg())
 
     async def loop(self, sleep=0):
         """
@@ -159,6 +816,76 @@ class MQTTClient:
         :param sleep: duration between two call of check_msg
         :return:
         """
+        self.start_draining()
         while True:
+            if self.spool is not None and not self.connected:
+                await self.restore()
+                continue
             await asyncio.sleep(sleep)
-            self.client.check_msg()
+            self.check_msg()
+            self.check_reconnect()
+            if self.inflight:
+                self.resend_inflight()
+
+    async def read_all(self):
+        """
+        Read packets until none is left. ssl may have buffered more packets, which
+        never wake up the reader. Other tasks run after every read_batch packets.
+        """
+        count = 0
+        while self.check_msg() is not None or self.pending():
+            count += 1
+            if count >= self.read_batch:
+                count = 0
+                await asyncio.sleep(0)
+
+    async def listen(self):
+        """
+        Like :py:meth:`loop`, but driven by socket readiness. The coroutine is only
+        woken up when bytes arrive or a PINGREQ is needed to keep the connection
+        alive, so there is neither busy polling nor extra latency. Each wakeup reads
+        packets until none is left, see :py:meth:`read_all`. If the event loop cannot
+        watch file descriptors, e.g., uasyncio, this falls back to :py:meth:`loop`.
+        """
+        event_loop = asyncio.get_event_loop()
+        if not hasattr(event_loop, 'add_reader'):
+            await self.loop()
+            return
+        ready = self.readable = asyncio.Event()
+        sock = fd = None
+        self.start_draining()
+        try:
+            while True:
+                if self.spool is not None and not self.connected:
+                    await self.restore()
+                    continue
+                # the socket changes after a reconnection
+                if self.client.sock is not sock:
+                    if fd is not None:
+                        event_loop.remove_reader(fd)
+                    sock = self.client.sock
+                    fd = sock.fileno()
+                    event_loop.add_reader(fd, ready.set)
+                self.check_reconnect()
+                timeout = self.next_retry()
+                if timeout is not None and timeout <= 0:
+                    self.resend_inflight()
+                    continue
+                keepalive = self.client.keepalive
+                if keepalive:
+                    # ping in the middle of the keepalive window
+                    ping = self.last_sent + keepalive / 2 - monotonic()
+                    if ping <= 0:
+                        self.ping()
+                        continue
+                    if timeout is None or ping < timeout:
+                        timeout = ping
+                try:
+                    await asyncio.wait_for(ready.wait(), timeout)
+                except asyncio.TimeoutError:
+                    continue
+                ready.clear()
+                await self.read_all()
+        finally:
+            if fd is not None:
+                event_loop.remove_reader(fd)
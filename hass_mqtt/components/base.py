@@ -6,11 +6,68 @@ try:
 except ImportError:
     import asyncio
 
-from ..model import Model, Field, json
+try:
+    from hashlib import sha1
+except ImportError:
+    from uhashlib import sha1
+from binascii import hexlify
+
+from ..model import Model, Field, Config
+from .. import serializer
 from ..client import MQTTClient
+from ..metrics import now
+from ..executor import default_executor, is_blocking, is_async
+from ..ratelimit import STATE, DISCOVERY
+
 
+def fingerprint(payload):
+    """fingerprint of an encoded payload"""
+    return hexlify(sha1(payload).digest()).decode()
 
-class Base(Model):
+
+class Fingerprints(Config):
+    """
+    Fingerprints of sent MQTT discovery configs keyed by their topics,
+    which can be persisted in a json file so that unchanged configs are
+    not sent again after a restart.
+    """
+    def __init__(self, file_path=None) -> None:
+        super().__init__()
+        self.file_path = file_path
+        self.dirty = False
+        if file_path is not None:
+            try:
+                self.load(file_path)
+            except (OSError, ValueError):  # missing or broken
+                self.data = {}
+
+    def changed(self, topic, digest):
+        """whether a config differs from the recorded one"""
+        return self.data.get(topic) != digest
+
+    def record(self, topic, digest):
+        """record the fingerprint of a sent config"""
+        self.data[topic] = digest
+        self.dirty = True
+        return self
+
+    def clear(self):
+        """forget all fingerprints so that every config is sent again"""
+        self.data = {}
+        self.dirty = True
+        return self
+
+    def save(self, file_path=None):
+        """Save to the json file if anything changes."""
+        if file_path is None:
+            file_path = self.file_path
+            if not self.dirty or file_path is None:
+                return
+        super().save(file_path)
+        self.dirty = False
+
+
+class Base(Model):  # pylint: disable=too-many-instance-attributes
     """
     This class define common behaviors of a component
     """
@@ -47,6 +104,19 @@ class Base(Model):
         self.value_path = None
         self.raw_value = None
         self.availability_payload = 'online'
+        # minimal change of a numeric value counted in delta mode
+        self.deadband = None
+        # seconds between two reads when driven by a scheduler
+        self.read_interval = self.default_sleep_time
+        # seconds allowed for a blocking reader or writer. None for no limit.
+        self.timeout = None
+        self.timeouts = 0
+        self.read_blocking = False
+        self.write_lock = None
+        self.write_tasks = set()
+        # (topic, payload, fingerprint) of the discovery config
+        self.config_cache = None
+        self.state_plan = None
         self.__post_init__()
 
     def __post_init__(self):
@@ -55,11 +125,21 @@ class Base(Model):
     def set_name(self, name):
         """set name"""
         self.name = name
+        self.invalidate_config()
+        return self
+
+    def set_deadband(self, deadband):
+        """
+        Set the deadband, e.g., 0.1 for a temperature only counts as changed
+        when it moves 0.1 °C. See :py:meth:`hass_mqtt.Device.set_delta`.
+        """
+        self.deadband = deadband
         return self
 
     def set_device(self, device):
         """set device"""
         self.device = device.data
+        self.invalidate_config()
 
     def default_name(self):
         """generate a correct name based on info of self"""
@@ -119,15 +199,14 @@ class Base(Model):
         self.make_value_template()
         return self.data
 
-    def publish(self, topic, msg, retain=False, qos=0):
+    def publish(self, topic, msg, retain=False, qos=0, coalesce=False, priority=STATE):
         """publish a message"""
         if not isinstance(msg, bytes):
-            msg = json.dumps(msg)
-            msg = msg.encode()
-        self.mqtt_client.publish(topic, msg, retain, qos)
+            msg = serializer.dumps(msg)
+        return self.mqtt_client.publish(topic, msg, retain, qos, coalesce, priority)
 
-    def send_config(self, retain=False, qos=0):
-        """send MQTT discovery config"""
+    def make_config_topic(self):
+        """generate the MQTT discovery topic and the object id"""
         topic = f"{self.hass_prefix}/{self.component_name}"
         node_id = self.node_id
         obj_id = self.obj_id
@@ -137,12 +216,78 @@ class Base(Model):
             obj_id = self.unique_id
         topic += f'/{obj_id}'
         topic += '/config'
-        data = self.make_config_data()
-        data['object_id'] = obj_id
-        self.publish(topic, data, retain, qos)
+        return topic, obj_id
+
+    def make_config(self):
+        """
+        Generate the topic, the encoded payload and its fingerprint of the MQTT
+        discovery config. The result is cached, so remember to call
+        :py:meth:`invalidate_config` after changing the data directly.
+        """
+        if self.config_cache is None:
+            topic, obj_id = self.make_config_topic()
+            data = self.make_config_data()
+            data['object_id'] = obj_id
+            status_topic = None if self.mqtt_client is None else self.mqtt_client.status_topic
+            if status_topic is not None:
+                data = self.with_status_topic(data, status_topic)
+            payload = serializer.dumps(data)
+            self.config_cache = (topic, payload, fingerprint(payload))
+        return self.config_cache
+
+    @staticmethod
+    def with_status_topic(data, status_topic):
+        """
+        Replace the availability topic in the discovery data by a list also
+        containing the status topic of the client, so that the entity is
+        unavailable when either of them is offline, e.g., by the last will.
+        """
+        data = dict(data)
+        availability = [{'topic': status_topic}]
+        topic = data.pop('availability_topic', None)
+        template = data.pop('availability_template', None)
+        if topic is not None:
+            entry = {'topic': topic}
+            if template is not None:
+                entry['value_template'] = template
+            availability.append(entry)
+        data['availability'] = availability
+        data['availability_mode'] = 'all'
+        return data
+
+    def invalidate_config(self):
+        """drop the cached discovery config"""
+        self.config_cache = None
+        return self
+
+    def send_config(self, retain=False, qos=0, fingerprints=None, force=False):
+        """
+        send MQTT discovery config
+
+        :param retain: MQTT retain
+        :param qos: MQTT qos
+        :param fingerprints: a :py:class:`Fingerprints`. If provided, the config
+            is only sent when its fingerprint differs from the recorded one.
+        :param force: send even if the fingerprint is unchanged
+        :return: whether the config is sent or not. The fingerprint is only
+            recorded once sent, so a config dropped by a full outbox is sent
+            again next time.
+        """
+        topic, payload, digest = self.make_config()
+        if fingerprints is not None and not force and not fingerprints.changed(topic, digest):
+            return False
+        if self.publish(topic, payload, retain, qos, priority=DISCOVERY) is False:
+            return False
+        if fingerprints is not None:
+            fingerprints.record(topic, digest)
+        return True
 
     def online(self, is_online=True, retain=True, qos=0):
-        """push availability"""
+        """
+        push availability. If the availability is shared within a device, the
+        whole payload is sent, so use :py:meth:`hass_mqtt.Device.update_availability`
+        to change many components at once.
+        """
         payload = 'offline'
         if is_online:
             payload = 'online'
@@ -179,36 +324,195 @@ class Base(Model):
     def value(self, new_value):
         self.set_value(new_value)
 
+    def compile_plan(self, retain=False, qos=0):
+        """
+        Compile the publish plan of the state topic, which is done when added
+        to a device or pushing the state for the first time.
+
+        :return: the plan or None if it cannot be planned
+        """
+        self.state_plan = MQTTClient.compile_plan(self.state_topic, retain, qos, self.state_plan)
+        return self.state_plan
+
     def push_state(self, retain=False, qos=0):
         """send the state"""
-        self.publish(self.state_topic, self.raw_value, retain, qos)
+        plan = self.compile_plan(retain, qos)
+        if plan is None:
+            self.publish(self.state_topic, self.raw_value, retain, qos, coalesce=True)
+            return
+        msg = self.raw_value
+        if not isinstance(msg, bytes):
+            msg = serializer.dumps(msg)
+        self.mqtt_client.publish_plan(plan, msg, coalesce=True)
 
     async def read(self):
         """how to read the value"""
         await asyncio.sleep(self.default_sleep_time)
 
-    def set_reader(self, func):
-        """set reader"""
-        setattr(self, 'read', func)
+    def set_timeout(self, timeout):
+        """set the seconds allowed for a blocking reader or writer"""
+        self.timeout = timeout
+        return self
+
+    async def run_blocking(self, func, *args):
+        """run a blocking function in the shared thread pool, counting timeouts"""
+        try:
+            return await default_executor.run(func, *args, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return None
+
+    def set_reader(self, func, blocking=None):
+        """
+        set reader. A plain function, e.g., polling a serial port, is run in the
+        shared thread pool within the timeout of the component, and :py:meth:`loop`
+        sleeps read_interval seconds between two reads. A coroutine function is
+        awaited directly and is expected to sleep by itself in :py:meth:`loop`.
+
+        :param func: the reader
+        :param blocking: run func in the thread pool or not. None to detect.
+        :return: func
+        """
+        if blocking is None:
+            blocking = is_blocking(func)
+        self.read_blocking = blocking
+        read = func
+        if blocking:
+            async def read_blocking():
+                await self.run_blocking(func)
+            read = read_blocking
+        setattr(self, 'read', read)
         return func
 
+    def has_reader(self):
+        """whether read is provided by a reader or a subclass"""
+        return 'read' in vars(self) or type(self).read is not Base.read
+
+    async def timed_read(self):
+        """read once, recording the latency in the metrics of the MQTT client"""
+        if self.mqtt_client is None:
+            await self.read()
+            return
+        stats = self.mqtt_client.metrics.read(self.unique_id)
+        stats.count += 1
+        tracer = self.mqtt_client.tracer
+        if tracer is not None:
+            name = f'read {self.unique_id}'
+            token = tracer.enter(name)
+        start = now()
+        try:
+            await self.read()
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            if tracer is not None:
+                tracer.exit(name, token)
+        stats.latency.observe(now() - start)
+
+    async def read_and_push(self):
+        """read once and push the state"""
+        await self.timed_read()
+        self.push_state()
+
+    def schedule(self, scheduler, push=True):
+        """
+        Let a shared :py:class:`hass_mqtt.scheduler.Scheduler` call read every
+        read_interval seconds instead of running :py:meth:`loop`. The reader
+        should therefore return without sleeping.
+
+        :param scheduler: the scheduler
+        :param push: push the state after reading
+        :return: the job or None if there is no reader
+        """
+        if not self.has_reader():
+            return None
+        func = self.timed_read
+        if push:
+            func = self.read_and_push
+        return scheduler.every(self.read_interval, func)
+
+    def after_read(self, push=True):
+        """called after each read of :py:meth:`loop`"""
+        if push:
+            self.push_state()
+
     async def loop(self, push=True):
         """read loop"""
         while True:
-            await self.read()
-            if push:
-                self.push_state()
+            await self.timed_read()
+            self.after_read(push)
+            if self.read_blocking:
+                await asyncio.sleep(self.read_interval)
 
     def write(self, msg):
         """write msg"""
 
-    def set_writer(self, func):
-        """set write"""
-        setattr(self, 'write', func)
+    async def write_in_order(self, func, msg):
+        """await an async writer after the previous writes"""
+        if self.write_lock is None:
+            self.write_lock = asyncio.Lock()
+        async with self.write_lock:
+            tracer = None if self.mqtt_client is None else self.mqtt_client.tracer
+            if tracer is None:
+                await func(msg)
+                return
+            name = f'write {self.unique_id}'
+            token = tracer.enter(name)
+            try:
+                await func(msg)
+            finally:
+                tracer.exit(name, token)
+
+    def make_writer(self, func, blocking=None):
+        """
+        Make write from a writer. A plain function is run in the shared thread pool
+        within the timeout of the component, while a coroutine function is spawned
+        as a task. Both are run in the order of commands without blocking the
+        receive loop, and write returns the task. Without a running event loop,
+        func is called inline and write returns its result.
+
+        A plain writer runs in a pool thread while the event loop may be encoding
+        the state, so it should not change the value of components itself. Hand
+        the change back to the loop instead, e.g.,
+        `loop.call_soon_threadsafe(component.set_value, value)`.
+
+        :param func: the writer
+        :param blocking: run func in the thread pool or not. None to detect.
+        :return: the write function
+        """
+        if blocking is None:
+            blocking = is_blocking(func)
+        if blocking:
+            def run(msg):
+                return self.run_blocking(func, msg)
+        elif is_async(func):
+            run = func
+        else:
+            return func
+
+        def write(msg):
+            coro = self.write_in_order(run, msg)
+            try:
+                task = asyncio.create_task(coro)
+            except RuntimeError:  # no running event loop
+                coro.close()
+                if blocking:
+                    return func(msg)
+                return asyncio.run(func(msg))
+            # keep a reference until done
+            self.write_tasks.add(task)
+            task.add_done_callback(self.write_tasks.discard)
+            return task
+        return write
+
+    def set_writer(self, func, blocking=None):
+        """set write. See :py:meth:`make_writer`."""
+        setattr(self, 'write', self.make_writer(func, blocking))
         return func
 
-    def on_command(self, func):
-        """This will trigger an MQTT subscribe"""
-        setattr(self, 'write', func)
+    def on_command(self, func, blocking=None):
+        """This will trigger an MQTT subscribe. See :py:meth:`make_writer`."""
+        setattr(self, 'write', self.make_writer(func, blocking))
         self.mqtt_client.subscribe(self.command_topic, self.write)
         return func
@@ -2,8 +2,14 @@
 Sensor Components. See https://www.home-assistant.io/integrations/sensor.mqtt/
 """
 import time
+from array import array
 from .base import Base,  Field
 
+try:
+    from time import monotonic
+except ImportError:
+    from time import time as monotonic
+
 
 EPOCH_YEAR = time.gmtime(0)[0]
 if EPOCH_YEAR == 2000:
@@ -41,6 +47,153 @@ class Sensor(Base):
         return super().make_config_data()
 
 
+class Diagnostic(Sensor):
+    """Diagnostic sensor, e.g., metrics of the gateway itself"""
+    default_device_class = None
+    entity_category = Field('entity_category')
+
+    def make_config_data(self):
+        if self.entity_category is None:
+            self.entity_category = 'diagnostic'
+        return super().make_config_data()
+
+
+class Aggregate(Sensor):
+    """
+    Aggregating sensor for high-rate sampling. The reader adds samples through
+    :py:meth:`add_sample`, and a summary is made every window seconds. The value
+    is the mean, while min, max and percentiles are written as extra keys
+    `<key>_min`, `<key>_max`, `<key>_p50`, ... of the value shared by the device,
+    which are also exposed as attributes of the entity. The last capacity samples
+    of a window are kept in an `array`, so the memory used is fixed. min, max and
+    mean are exact, while percentiles are computed from the kept samples.
+    """
+    default_capacity = 1024
+    default_window = 10
+    default_percentiles = (50, 95)
+
+    json_attributes_topic = Field('json_attributes_topic')
+    json_attributes_template = Field('json_attributes_template')
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.window = self.default_window
+        self.percentiles = self.default_percentiles
+        self.samples = array('d')
+        # the ring buffer and the running summary of the window, see reset
+        self.head = 0
+        self.size = 0
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.window_start = None
+        self.set_capacity(self.default_capacity)
+        self.summary = {}
+        self.summary_job = None
+
+    def set_capacity(self, capacity):
+        """set the size of the ring buffer, dropping kept samples"""
+        self.samples = array('d', [0.0] * capacity)
+        self.reset()
+        return self
+
+    def set_window(self, window):
+        """set the seconds of a window"""
+        self.window = window
+        return self
+
+    def reset(self):
+        """start a new window"""
+        self.head = 0
+        self.size = 0
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.window_start = monotonic()
+
+    def add_sample(self, sample):
+        """add a sample"""
+        samples = self.samples
+        samples[self.head] = sample
+        self.head += 1
+        if self.head == len(samples):
+            self.head = 0
+        if self.size < len(samples):
+            self.size += 1
+        self.count += 1
+        self.total += sample
+        if self.minimum is None or sample < self.minimum:
+            self.minimum = sample
+        if self.maximum is None or sample > self.maximum:
+            self.maximum = sample
+        return self
+
+    def summary_keys(self):
+        """names of the extra keys"""
+        keys = ['min', 'max', 'count']
+        keys.extend(f'p{percentile}' for percentile in self.percentiles)
+        return keys
+
+    def summarize(self):
+        """
+        Make the summary of the current window and start a new one.
+        Nothing changes if there are no samples.
+
+        :return: the summary
+        """
+        if not self.count:
+            self.reset()
+            return self.summary
+        ordered = sorted(self.samples[:self.size])
+        last = len(ordered) - 1
+        summary = {'min': self.minimum, 'max': self.maximum, 'count': self.count}
+        for percentile in self.percentiles:
+            summary[f'p{percentile}'] = ordered[round(last * percentile / 100)]
+        self.value = self.total / self.count
+        if self.value_path is not None:
+            for key, item in summary.items():
+                self.raw_value[f'{self.value_path}_{key}'] = item
+        self.summary = summary
+        self.reset()
+        return summary
+
+    def window_due(self):
+        """whether the current window is over"""
+        return monotonic() - self.window_start >= self.window
+
+    def summarize_and_push(self):
+        """summarize and push the state"""
+        self.summarize()
+        self.push_state()
+
+    def make_config_data(self):
+        if self.value_path is not None:
+            if self.json_attributes_topic is None:
+                self.json_attributes_topic = self.state_topic
+            if self.json_attributes_template is None:
+                pairs = ', '.join(f'"{key}": value_json.{self.value_path}_{key}' for key in self.summary_keys())
+                self.json_attributes_template = '{{ {%s} | tojson }}' % pairs
+        return super().make_config_data()
+
+    def after_read(self, push=True):
+        """summarize every window"""
+        if self.window_due():
+            self.summarize()
+            if push:
+                self.push_state()
+
+    def schedule(self, scheduler, push=True):
+        """read every read_interval seconds and summarize every window"""
+        job = super().schedule(scheduler, push=False)
+        func = self.summarize
+        if push:
+            func = self.summarize_and_push
+        self.summary_job = scheduler.every(self.window, func, delay=self.window)
+        return job
+
+
 class Temperature(Sensor):
     """Temperature sensor"""
     default_device_class = "temperature"
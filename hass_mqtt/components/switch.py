@@ -12,4 +12,6 @@ class Switch(Base):
         self.value = "ON"
 
     def write(self, msg):
+        if isinstance(msg, bytes):  # commands are received in bytes
+            msg = msg.decode()
         self.value = msg
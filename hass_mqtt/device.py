@@ -8,17 +8,38 @@ except ImportError:
     import asyncio
 
 try:
-    import ujson as json
+    from time import monotonic
 except ImportError:
-    import json
+    from time import time as monotonic
 
 
 from .model import Model, Field, DefaultFactory
 from .client import MQTTClient
+from .encoder import IncrementalEncoder
+from .metrics import SENSORS, Stats, now
+from .ratelimit import COMMAND, STATE, HEARTBEAT
 from . import components
 
 
-class Device(Model):
+class Shard:
+    """
+    A state sub-topic of a device. It holds the values of its components and,
+    like the device itself for unsharded components, the encoder, publish plan
+    and delta state of its topic.
+    """
+
+    def __init__(self, name, state_topic):
+        self.name = name
+        self.state_topic = state_topic
+        self.keys = []
+        self.value = {}
+        self.encoder = IncrementalEncoder()
+        self.state_plan = None
+        self.last_state = None
+        self.last_push = None
+
+
+class Device(Model):  # pylint: disable=too-many-instance-attributes
     """device class"""
     hass_prefix = "homeassistant"
 
@@ -59,33 +80,178 @@ class Device(Model):
         self.node_id = node_id
         self.counter = 0
         self.components = {}
+        # command key in bytes -> component
+        self.commands = {}
+        self.dropped_commands = 0
         self.setdefault('serial_number', 'serial')
         # the value shared by all
         self.value = {}
+        self.encoder = IncrementalEncoder()
+        self.state_plan = None
         self.state_topic = None
         self.command_topic = None
         self.availability_topic = None
         self.availability_payload = {}
+        # delta mode
+        self.delta = False
+        self.max_interval = None
+        self.last_state = None
+        self.last_push = None
+        self.fingerprints = None
+        # state sub-topics, see add_component
+        self.shards = {}
+        self.shard_size = None
+        # key of component -> shard, for sharded components only
+        self.component_shards = {}
+        # state echo after commands
+        self.echo_delay = 0.02
+        self.echo_pending = []
+        self.echo_holders = []
+        self.echo_task = None
+        self.echo_stats = Stats()
 
     def on_command(self, msg):
-        """callback of MQTT subscription"""
-        key, msg = msg.split(b';')
-        key = key.decode()
-        target: components.Base = self.components.get(key)
-        if target is not None:
-            target.write(msg)
+        """
+        callback of MQTT subscription. A command looks like `key;payload`, where
+        the payload may contain extra `;`. Malformed commands or unknown keys
+        are counted in dropped_commands. After the write, the state is echoed,
+        see :py:meth:`set_echo`.
+        """
+        key, sep, payload = msg.partition(b';')
+        target = self.commands.get(key)
+        if not sep or target is None:
+            self.dropped_commands += 1
+            return
+        if self.mqtt_client is None:
+            target.write(payload)
+            return
+        received = now()
+        tracer = self.mqtt_client.tracer
+        if tracer is None:
+            written = target.write(payload)
+        else:
+            name = f'command {target.unique_id}'
+            token = tracer.enter(name)
+            try:
+                written = target.write(payload)
+            finally:
+                tracer.exit(name, token)
+        if self.echo_delay is None:
+            return
+        holder = self.component_shards.get(target.value_path, self)
+        if hasattr(written, 'add_done_callback'):  # a task of a writer
+            written.add_done_callback(lambda _: self.request_echo(received, holder))
+        else:
+            self.request_echo(received, holder)
 
     def subscribe(self):
         """subscribe to mqtt"""
         self.mqtt_client.subscribe(self.command_topic, self.on_command)
+        self.echo_stats = self.mqtt_client.metrics.echo(self.serial_number)
+
+    def set_echo(self, delay=0.02, enable=True):
+        """
+        Push the state right after commands are written instead of waiting for
+        the push loop. Commands within delay seconds are coalesced into one
+        push. The latency from receiving a command to publishing the state is
+        recorded in echo_stats, which is also in the metrics of the client.
+
+        :param delay: seconds to wait for more commands. 0 to only coalesce
+            commands handled in the same iteration of the event loop.
+        :param enable: enable the echo or not
+        :return: self
+        """
+        self.echo_delay = delay if enable else None
+        return self
+
+    def request_echo(self, received, holder=None):
+        """
+        schedule a state echo for a command received at received
+
+        :param received: the time from :py:func:`hass_mqtt.metrics.now`
+        :param holder: the device or the :py:class:`Shard` to push. None for the device.
+        """
+        self.echo_pending.append(received)
+        holder = self if holder is None else holder
+        if holder not in self.echo_holders:
+            self.echo_holders.append(holder)
+        if self.echo_task is not None:
+            return
+        coro = self.echo_later()
+        try:
+            self.echo_task = asyncio.create_task(coro)
+        except RuntimeError:  # no running event loop
+            coro.close()
+            self.push_echo()
+
+    async def echo_later(self):
+        """push the echo after the delay"""
+        try:
+            await asyncio.sleep(self.echo_delay or 0)
+        finally:
+            self.echo_task = None
+        self.push_echo()
+
+    def push_echo(self):
+        """push the state and record the latency of pending commands"""
+        pending = self.echo_pending
+        holders = self.echo_holders
+        self.echo_pending = []
+        self.echo_holders = []
+        for holder in holders:
+            self.push_holder(holder, force=True, priority=COMMAND)
+        published = now()
+        stats = self.echo_stats
+        for received in pending:
+            stats.count += 1
+            stats.latency.observe(published - received)
 
     def yield_name(self, prefix):
         """make new names"""
         self.counter += 1
         return f'{self.serial_number}_{prefix}_{self.counter}'
 
-    def add_component(self, key: str, target: components.Base):
-        """add component"""
+    def set_sharding(self, shard_size=None):
+        """
+        Split the state of components added later across sub-topics of the state
+        topic, `<state_topic>/<shard>`, so that a push only carries the values
+        of a shard, and Home Assistant only parses them for its entities.
+
+        :param shard_size: put at most so many components into each automatic
+            shard, named `0`, `1` and so on. None to only use explicit shards,
+            see :py:meth:`add_component`.
+        :return: self
+        """
+        self.shard_size = shard_size
+        return self
+
+    def get_shard(self, name):
+        """the shard of a name, created if needed"""
+        shard = self.shards.get(name)
+        if shard is None:
+            shard = self.shards[name] = Shard(name, f'{self.state_topic}/{name}')
+        return shard
+
+    def auto_shard(self):
+        """the first automatic shard with space"""
+        index = 0
+        while True:
+            shard = self.get_shard(str(index))
+            if len(shard.keys) < self.shard_size:
+                return shard
+            index += 1
+
+    def add_component(self, key: str, target: components.Base, shard=None):
+        """
+        add component
+
+        :param key: the key of the component in the state and commands
+        :param target: the component
+        :param shard: the name of a state sub-topic to put the component in.
+            None for an automatic one if :py:meth:`set_sharding` is set,
+            otherwise the state topic of the device.
+        :return: target
+        """
         target.mqtt_client = self.mqtt_client
         if target.node_id is None:
             target.node_id = self.node_id
@@ -95,18 +261,48 @@ class Device(Model):
         if key in self.components:
             raise KeyError(f'duplicated key: {key}')
         self.components[key] = target
+        self.commands[key.encode()] = target
         # set device info
         target.set_device(self)
         # set value
-        self.value[key] = target.value
-        target.raw_value = self.value
+        holder = self
+        if shard is not None:
+            holder = self.get_shard(shard)
+        elif self.shard_size is not None:
+            holder = self.auto_shard()
+        if holder is not self:
+            holder.keys.append(key)
+            self.component_shards[key] = holder
+        holder.value[key] = target.value
+        target.raw_value = holder.value
         target.value_path = key
         # set topics
-        target.state_topic = self.state_topic
+        target.state_topic = holder.state_topic
         target.command_topic = self.command_topic
         target.command_template = '%s;{{ value }}' % key
+        target.invalidate_config()
+        target.compile_plan()
+        self.compile_plan(holder=holder)
         return target
 
+    def add_metric_sensors(self, metrics=None, prefix='mqtt'):
+        """
+        Expose the totals of metrics as diagnostic sensors. Call
+        :py:meth:`hass_mqtt.metrics.Metrics.update_sensors` before pushing the state.
+
+        :param metrics: a :py:class:`hass_mqtt.metrics.Metrics`, by default that of the client
+        :param prefix: prefix of the keys of the sensors
+        :return: self
+        """
+        if metrics is None:
+            metrics = self.mqtt_client.metrics
+        for key, (name, unit) in SENSORS.items():
+            target = components.sensor.Diagnostic().set_name(name)
+            if unit is not None:
+                target.unit_of_measurement = unit
+            metrics.sensors[key] = self.add_component(f'{prefix}_{key}', target)
+        return self
+
     def set_availability(self):
         """set availability"""
         target: components.Base
@@ -114,28 +310,172 @@ class Device(Model):
             target.availability_topic = self.availability_topic
             target.availability_template = '{{ value_json.%s }}' % key
             target.availability_payload = self.availability_payload
+            target.invalidate_config()
+
+    def set_fingerprints(self, fingerprints: components.Fingerprints):
+        """
+        Record fingerprints of the sent discovery configs, so that :py:meth:`send_config`
+        only sends new or changed configs on start and reconnect.
+        """
+        self.fingerprints = fingerprints
+        return self
 
-    def send_config(self, retain=True, qos=0):
-        """send config"""
+    def invalidate_config(self):
+        """drop the cached discovery configs of all components, e.g., after :py:meth:`configure`"""
         target: components.Base
         for target in self.components.values():
-            target.send_config(retain, qos)
+            target.invalidate_config()
+        return self
+
+    def send_config(self, retain=True, qos=0, force=False):
+        """
+        send config
+
+        :param retain: MQTT retain
+        :param qos: MQTT qos
+        :param force: send all configs even if they are recorded in the fingerprints
+        :return: self
+        """
+        target: components.Base
+        for target in self.components.values():
+            target.send_config(retain, qos, self.fingerprints, force)
+        if self.fingerprints is not None:
+            self.fingerprints.save()
         return self
 
     def online(self, is_online=True, retain=True, qos=0):
-        """push availability"""
-        payload = 'offline'
-        if is_online:
-            payload = 'online'
-        for key in self.components:
-            self.availability_payload[key] = payload
-        self.mqtt_client.publish(self.availability_topic, self.availability_payload, retain, qos)
-
-    def push_state(self, retain=False, qos=0):
-        """push state"""
-        msg = json.dumps(self.value)
-        msg = msg.encode()
-        self.mqtt_client.publish(self.state_topic, msg, retain, qos)
+        """push availability of all components"""
+        self.update_availability(dict.fromkeys(self.components, is_online), retain, qos, force=True)
+
+    def update_availability(self, states, retain=True, qos=0, force=False):
+        """
+        Change the availability of many components with one message
+
+        :param states: a dict from keys of components to whether they are online
+        :param retain: MQTT retain
+        :param qos: MQTT qos
+        :param force: publish even if nothing changes
+        :return: whether the availability is published or not
+        """
+        payload = self.availability_payload
+        changed = False
+        for key, is_online in states.items():
+            if key not in self.components:
+                raise KeyError(f'unknown key: {key}')
+            value = 'online' if is_online else 'offline'
+            if payload.get(key) != value:
+                payload[key] = value
+                changed = True
+        if not changed and not force:
+            return False
+        self.mqtt_client.publish(self.availability_topic, payload, retain, qos)
+        return True
+
+    def set_delta(self, max_interval=None, enable=True):
+        """
+        Only push the state when it changes. Numeric values are compared
+        with the deadband of their components, see :py:meth:`components.Base.set_deadband`.
+
+        :param max_interval: seconds after which the state is pushed anyway. None for never.
+        :param enable: enable delta mode or not
+        :return: self
+        """
+        self.delta = enable
+        self.max_interval = max_interval
+        for holder in self.holders():
+            holder.last_state = None
+            holder.last_push = None
+        return self
+
+    def holders(self):
+        """the device, if it has unsharded components, and the shards"""
+        holders = list(self.shards.values())
+        if self.value or not holders:
+            holders.insert(0, self)
+        return holders
+
+    def changed(self, holder=None):
+        """
+        whether the state has changed since the last push
+
+        :param holder: the device or a :py:class:`Shard`. None for the device.
+        """
+        holder = self if holder is None else holder
+        last_state = holder.last_state
+        value = holder.value
+        if last_state is None or len(last_state) != len(value):
+            return True
+        for key, value in value.items():
+            if key not in last_state:
+                return True
+            old = last_state[key]
+            # extra keys, e.g., of an aggregate sensor, have no component
+            target = self.components.get(key)
+            deadband = None if target is None else target.deadband
+            if deadband is not None and isinstance(value, (int, float)) and isinstance(old, (int, float)):
+                if abs(value - old) >= deadband:
+                    return True
+            elif value != old:
+                return True
+        return False
+
+    def compile_plan(self, retain=False, qos=0, holder=None):
+        """
+        Compile the publish plan of the state topic, which is done when adding
+        a component or pushing the state for the first time.
+
+        :param holder: the device or a :py:class:`Shard`. None for the device.
+        :return: the plan or None if it cannot be planned
+        """
+        holder = self if holder is None else holder
+        holder.state_plan = MQTTClient.compile_plan(holder.state_topic, retain, qos, holder.state_plan)
+        return holder.state_plan
+
+    def push_state(self, retain=False, qos=0, force=False, priority=None):
+        """
+        push state. With shards, each of them is pushed separately, and in delta
+        mode only the changed ones.
+
+        :param retain: MQTT retain
+        :param qos: MQTT qos
+        :param force: push even if nothing changes in delta mode
+        :param priority: the lane in the outbox. None for state or heartbeat.
+        :return: whether any state is published or not
+        """
+        if not self.shards:
+            return self.push_holder(self, retain, qos, force, priority)
+        pushed = False
+        for holder in self.holders():
+            if self.push_holder(holder, retain, qos, force, priority):
+                pushed = True
+        return pushed
+
+    def push_holder(self, holder, retain=False, qos=0, force=False, priority=None):
+        """
+        push the state of the device or a shard
+
+        :param holder: the device or a :py:class:`Shard`
+        :return: whether the state is published or not
+        """
+        if priority is None:
+            priority = STATE
+        if self.delta and not force and not self.changed(holder):
+            heartbeat = self.max_interval is not None and holder.last_push is not None \
+                and monotonic() - holder.last_push >= self.max_interval
+            if not heartbeat:
+                return False
+            # an unchanged state yields to others
+            priority = HEARTBEAT
+        msg = holder.encoder.encode(holder.value)
+        plan = self.compile_plan(retain, qos, holder)
+        if plan is None:
+            self.mqtt_client.publish(holder.state_topic, msg, retain, qos, True, priority)
+        else:
+            self.mqtt_client.publish_plan(plan, msg, True, priority)
+        if self.delta:
+            holder.last_state = dict(holder.value)
+            holder.last_push = monotonic()
+        return True
 
     async def push_loop(self, sleep=1):
         """push loop"""
@@ -143,6 +483,22 @@ class Device(Model):
             self.push_state()
             await asyncio.sleep(sleep)
 
+    def schedule(self, scheduler, sleep=1):
+        """
+        Use a shared :py:class:`hass_mqtt.scheduler.Scheduler` instead of :py:meth:`loop`.
+        Components are read every read_interval seconds and the state is pushed
+        every sleep seconds.
+
+        :param scheduler: the scheduler
+        :param sleep: seconds between two pushes
+        :return: the jobs
+        """
+        target: components.Base
+        jobs = [target.schedule(scheduler, push=False) for target in self.components.values()]
+        jobs = [job for job in jobs if job is not None]
+        jobs.append(scheduler.every(sleep, self.push_state))
+        return jobs
+
     async def loop(self, sleep=1):
         """loop"""
         awaitable = [x.loop(push=False) for x in self.components.values()]
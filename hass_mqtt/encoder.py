@@ -0,0 +1,52 @@
+"""
+This provides an incremental json encoder of the state shared by components
+of a device. The encoded `"key": value` fragment of each key is cached, so only
+values changed since the last push are encoded again.
+"""
+
+from . import serializer
+
+
+# values of these types can be compared safely with the cached ones
+SCALARS = (str, int, float, bool, type(None))
+
+
+class IncrementalEncoder:
+    """Encode a flat :py:class:`dict` reusing cached fragments"""
+
+    def __init__(self):
+        # key -> (value, fragment)
+        self.cache = {}
+        self.encoded = 0
+        self.reused = 0
+
+    def fragment(self, key, value):
+        """the encoded `"key": value` in bytes"""
+        cached = self.cache.get(key)
+        # type check first, since 1 == 1.0 == True
+        if cached is not None and type(value) is type(cached[0]) and type(value) in SCALARS \
+                and value == cached[0]:
+            self.reused += 1
+            return cached[1]
+        dumps = serializer.dumps
+        fragment = dumps(key) + b': ' + dumps(value)
+        self.cache[key] = (value, fragment)
+        self.encoded += 1
+        return fragment
+
+    def encode(self, value):
+        """
+        Encode a dict
+
+        :param value: a dict with str keys
+        :return: json in bytes
+        """
+        fragments = [self.fragment(key, item) for key, item in value.items()]
+        if len(self.cache) > len(fragments):
+            # forget removed keys
+            self.cache = {key: self.cache[key] for key in value}
+        return b'{' + b', '.join(fragments) + b'}'
+
+    def clear(self):
+        """drop all cached fragments"""
+        self.cache = {}
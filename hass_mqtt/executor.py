@@ -0,0 +1,77 @@
+"""
+A bounded thread pool shared by components whose readers or writers are
+plain blocking functions, e.g., polling sysfs, I2C, serial ports or HTTP,
+so that a slow device does not stall the event loop.
+"""
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+try:
+    from inspect import iscoroutinefunction
+except ImportError:
+    iscoroutinefunction = None
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:  # no threads, e.g., MicroPython
+    ThreadPoolExecutor = None
+
+
+class Executor:
+    """A lazily created thread pool"""
+
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self.pool = None
+
+    def set_max_workers(self, max_workers):
+        """set the size of the pool. This only works before the pool is used."""
+        self.max_workers = max_workers
+        return self
+
+    def get_pool(self):
+        """create the pool if needed"""
+        if self.pool is None and ThreadPoolExecutor is not None:
+            self.pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='hass_mqtt')
+        return self.pool
+
+    async def run(self, func, *args, timeout=None):
+        """
+        Run a blocking function in the pool. Without threads, it is just called.
+
+        :param func: the function
+        :param args: arguments
+        :param timeout: seconds to wait. The thread cannot be interrupted, so it
+            keeps running after a timeout, but the caller is released.
+        :return: the result
+        """
+        pool = self.get_pool()
+        if pool is None:
+            return func(*args)
+        future = asyncio.get_event_loop().run_in_executor(pool, func, *args)
+        return await asyncio.wait_for(future, timeout)
+
+    def shutdown(self, wait=True):
+        """shutdown the pool"""
+        if self.pool is not None:
+            self.pool.shutdown(wait)
+            self.pool = None
+
+
+# the pool shared by components
+default_executor = Executor()
+
+
+def is_blocking(func):
+    """whether func is a plain function rather than a coroutine function"""
+    if iscoroutinefunction is None:  # unable to tell
+        return False
+    return not iscoroutinefunction(func)
+
+
+def is_async(func):
+    """whether func is a coroutine function"""
+    return iscoroutinefunction is not None and iscoroutinefunction(func)
@@ -0,0 +1,248 @@
+"""
+Build devices and components from a json description, e.g.,
+
+.. code-block:: json
+
+    {
+        "devices": [
+            {
+                "device": {"name": "Kitchen", "serial_number": "kitchen", "manufacturer": "me"},
+                "components": {
+                    "temperature": {"type": "temperature", "deadband": 0.1},
+                    "light": {"type": "switch", "name": "Light"}
+                }
+            }
+        ]
+    }
+
+Each component accepts `type`, and optionally `name`, `data` (extra discovery fields),
+`deadband`, `read_interval`, `timeout` and `shard` (a state sub-topic). A device accepts
+`device` (fields of :py:class:`hass_mqtt.Device`), `components`, and optionally `node_id`,
+`state_topic`, `command_topic`, `availability_topic`, `availability` (true by default)
+and `shard_size`, see :py:meth:`hass_mqtt.Device.set_sharding`.
+
+The resolved form, i.e., unique ids, topics, templates and encoded discovery configs,
+can be cached in a file, so that a repeat start with the same description, package
+version and json backend skips deriving them again.
+"""
+
+from . import __version__, serializer
+from .model import Config
+from .device import Device
+from .components import Switch, sensor, fingerprint
+
+TYPES = {
+    'switch': Switch,
+    'sensor': sensor.Sensor,
+    'temperature': sensor.Temperature,
+    'humidity': sensor.Humidity,
+    'battery': sensor.Battery,
+    'timestamp': sensor.Timestamp,
+    'aggregate': sensor.Aggregate,
+    'diagnostic': sensor.Diagnostic,
+}
+
+DEVICE_KEYS = ('device', 'components', 'node_id', 'state_topic', 'command_topic',
+               'availability_topic', 'availability', 'shard_size')
+DEVICE_FIELDS = ('name', 'configuration_url', 'connections', 'hw_version', 'identifiers', 'manufacturer',
+                 'model', 'model_id', 'serial_number', 'suggested_area', 'sw_version', 'via_device')
+COMPONENT_KEYS = ('type', 'name', 'data', 'deadband', 'read_interval', 'timeout', 'shard')
+
+
+def register(name, cls):
+    """register a component class under a type name"""
+    TYPES[name] = cls
+    return cls
+
+
+class Fleet(Config):
+    """
+    A json description of devices. Call :py:meth:`build` to make the devices.
+    """
+
+    def __init__(self, file_path=None, cache_path=None) -> None:
+        """
+        :param file_path: path of the description
+        :param cache_path: path of the cache of the resolved form. None for no cache.
+        """
+        super().__init__(file_path)
+        self.cache_path = cache_path
+        self.cache_hit = False
+
+    @property
+    def devices(self):
+        """descriptions of devices"""
+        return self.data.get('devices', [])
+
+    def validate(self):
+        """
+        Check the description
+
+        :raise ValueError: if anything is wrong
+        :return: self
+        """
+        devices = self.data.get('devices')
+        if not isinstance(devices, list):
+            raise ValueError('devices: a list is required')
+        serial_numbers = set()
+        for i, desc in enumerate(devices):
+            path = f'devices[{i}]'
+            if not isinstance(desc, dict):
+                raise ValueError(f'{path}: an object is required')
+            for key in desc:
+                if key not in DEVICE_KEYS:
+                    raise ValueError(f'{path}: unknown key {key}')
+            info = desc.get('device')
+            if not isinstance(info, dict) or not info.get('serial_number'):
+                raise ValueError(f'{path}.device: serial_number is required')
+            for key in info:
+                if key not in DEVICE_FIELDS:
+                    raise ValueError(f'{path}.device: unknown field {key}')
+            serial_number = info['serial_number']
+            if serial_number in serial_numbers:
+                raise ValueError(f'{path}.device: duplicated serial_number {serial_number}')
+            serial_numbers.add(serial_number)
+            components = desc.get('components', {})
+            if not isinstance(components, dict):
+                raise ValueError(f'{path}.components: an object is required')
+            for key, component in components.items():
+                self.validate_component(f'{path}.components.{key}', component)
+        return self
+
+    @staticmethod
+    def validate_component(path, component):
+        """check the description of a component"""
+        if not isinstance(component, dict):
+            raise ValueError(f'{path}: an object is required')
+        for key in component:
+            if key not in COMPONENT_KEYS:
+                raise ValueError(f'{path}: unknown key {key}')
+        if component.get('type') not in TYPES:
+            raise ValueError(f'{path}: unknown type {component.get("type")}')
+        if not isinstance(component.get('data', {}), dict):
+            raise ValueError(f'{path}.data: an object is required')
+
+    def fingerprint(self):
+        """fingerprint of the description"""
+        return fingerprint(serializer.dumps(self.data, sort_keys=True))
+
+    def load_cache(self, digest):
+        """the cached resolved form of the description, or None"""
+        if self.cache_path is None:
+            return None
+        cache = Config()
+        try:
+            cache.load(self.cache_path)
+        except (OSError, ValueError):  # missing or broken
+            return None
+        if cache.data.get('fingerprint') != digest:
+            return None
+        return cache.data.get('devices')
+
+    def save_cache(self, digest, devices):
+        """save the resolved form"""
+        resolved = []
+        for device in devices:
+            components = {}
+            for key, target in device.components.items():
+                data = dict(target.data)
+                data.pop('device', None)
+                topic, payload, config_digest = target.make_config()
+                components[key] = {'data': data, 'config': [topic, payload.decode(), config_digest]}
+            resolved.append({
+                'device': device.data,
+                'node_id': device.node_id,
+                'state_topic': device.state_topic,
+                'command_topic': device.command_topic,
+                'availability_topic': device.availability_topic,
+                'components': components,
+            })
+        cache = Config()
+        cache.data = {'fingerprint': digest, 'devices': resolved}
+        cache.save(self.cache_path)
+
+    def build(self, mqtt_client=None):
+        """
+        Validate the description and build all devices
+
+        :param mqtt_client: the :py:class:`hass_mqtt.MQTTClient` shared by devices
+        :return: a list of :py:class:`hass_mqtt.Device`
+        """
+        self.validate()
+        digest = None
+        cached = None
+        if self.cache_path is not None:
+            status_topic = None if mqtt_client is None else mqtt_client.status_topic
+            # the encoded configs also depend on the code and the json backend
+            digest = fingerprint(
+                f'{self.fingerprint()}:{status_topic}:{__version__}:{serializer.backend}'.encode())
+            cached = self.load_cache(digest)
+        self.cache_hit = cached is not None
+        if cached is None:
+            devices = [self.build_device(desc, mqtt_client) for desc in self.devices]
+            if digest is not None:
+                self.save_cache(digest, devices)
+            return devices
+        return [self.build_device(desc, mqtt_client, resolved) for desc, resolved in zip(self.devices, cached)]
+
+    @staticmethod
+    def build_device(desc, mqtt_client=None, resolved=None):
+        """
+        Build a device
+
+        :param desc: the description
+        :param mqtt_client: the MQTT client
+        :param resolved: the cached resolved form
+        :return: the device
+        """
+        if resolved is None:
+            device = Device(mqtt_client=mqtt_client, node_id=desc.get('node_id'))
+            device.state_topic = desc.get('state_topic')
+            device.command_topic = desc.get('command_topic')
+            device.availability_topic = desc.get('availability_topic')
+            info = dict(desc['device'])
+            url = info.pop('configuration_url', None)
+            device.configure(url=url, **info)
+        else:
+            device = Device(dict(resolved['device']), mqtt_client=mqtt_client, node_id=resolved['node_id'])
+            device.state_topic = resolved['state_topic']
+            device.command_topic = resolved['command_topic']
+            device.availability_topic = resolved['availability_topic']
+        device.set_sharding(desc.get('shard_size'))
+        for key, component in desc.get('components', {}).items():
+            data = None if resolved is None else resolved['components'][key]['data']
+            target = Fleet.build_component(component, data)
+            device.add_component(key, target, component.get('shard'))
+        if desc.get('availability', True):
+            device.set_availability()
+        for key, target in device.components.items():
+            if resolved is None:
+                target.make_config()
+            else:
+                topic, payload, digest = resolved['components'][key]['config']
+                target.config_cache = (topic, payload.encode(), digest)
+        return device
+
+    @staticmethod
+    def build_component(component, data=None):
+        """
+        Build a component
+
+        :param component: the description
+        :param data: the cached resolved data
+        :return: the component
+        """
+        cls = TYPES[component['type']]
+        if data is None:
+            target = cls(dict(component.get('data', {})))
+            if 'name' in component:
+                target.set_name(component['name'])
+        else:
+            target = cls(dict(data))
+        if 'deadband' in component:
+            target.set_deadband(component['deadband'])
+        if 'read_interval' in component:
+            target.read_interval = component['read_interval']
+        if 'timeout' in component:
+            target.set_timeout(component['timeout'])
+        return target
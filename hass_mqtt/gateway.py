@@ -0,0 +1,371 @@
+"""
+Run the devices of a :py:class:`hass_mqtt.fleet.Fleet` in several worker
+processes, each of which has its own MQTT connection and event loop, e.g.,
+
+.. code-block:: python
+
+    gateway = Gateway(info, Fleet('fleet.json'), workers=4, setup=attach_readers)
+    gateway.run()
+
+Devices are assigned to workers by rendezvous hashing of their serial numbers,
+so the assignment is stable between runs, and removing a worker only moves its
+own devices. A worker connects with `<client_id>-<worker id>`, and uses
+`<status_topic>/<worker id>` as its last will if a status topic is set.
+
+The supervisor restarts crashed workers. A worker crashing too often is given
+up and its devices are quarantined with it rather than moved to the others,
+so a device crashing its worker cannot take the rest down. Call
+:py:meth:`Gateway.retry` after fixing it. Workers report their totals of
+:py:class:`hass_mqtt.metrics.Metrics` periodically, which are aggregated by
+:py:meth:`Gateway.health`.
+"""
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+import multiprocessing
+import os
+import time
+import zlib
+from functools import partial
+from queue import Empty
+
+from .client import MQTTClient, MQTTInfo, monotonic
+from .fleet import Fleet
+
+COUNTERS = ('messages_in', 'bytes_in', 'messages_out', 'bytes_out', 'errors')
+
+
+def weight(worker_id, key):
+    """the rendezvous weight of a key on a worker"""
+    return zlib.crc32(f'{worker_id}:{key}'.encode())
+
+
+def assign(descriptions, worker_ids):
+    """
+    Assign devices to workers
+
+    :param descriptions: descriptions of devices
+    :param worker_ids: ids of available workers
+    :return: a dict from a worker id to a list of descriptions
+    """
+    shards = {worker_id: [] for worker_id in worker_ids}
+    if not shards:
+        return shards
+    for desc in descriptions:
+        key = desc['device']['serial_number']
+        worker_id = max(worker_ids, key=partial(weight, key=key))
+        shards[worker_id].append(desc)
+    return shards
+
+
+async def report_loop(worker_id, mqtt_client, devices, queue, interval):
+    """send the totals to the supervisor"""
+    while True:
+        totals = mqtt_client.metrics.totals()
+        totals['latency'] = totals['latency'].snapshot()
+        queue.put({
+            'worker': worker_id,
+            'pid': os.getpid(),
+            'time': time.time(),
+            'devices': len(devices),
+            'totals': totals,
+        })
+        await asyncio.sleep(interval)
+
+
+async def worker_loop(worker_id, mqtt_client, devices, queue, options):
+    """run devices, the receive loop and reporting"""
+    awaitable = [device.loop(options['sleep']) for device in devices]
+    awaitable.append(mqtt_client.listen())
+    awaitable.append(report_loop(worker_id, mqtt_client, devices, queue, options['report_interval']))
+    await asyncio.gather(*awaitable)
+
+
+def run_worker(worker_id, info_data, descriptions, queue, setup, options):
+    """
+    The entry of a worker process
+
+    :param worker_id: the worker id
+    :param info_data: data of :py:class:`hass_mqtt.MQTTInfo`
+    :param descriptions: descriptions of devices of the shard
+    :param queue: queue of reports
+    :param setup: None or a function called with devices and the client before running,
+        e.g., to set readers and writers. It must be picklable.
+    :param options: sleep, keepalive, report_interval and cache_path
+    """
+    info = MQTTInfo(dict(info_data))
+    info.client_id = f'{info.client_id}-{worker_id}'
+    if info.status_topic is not None:  # the last will of a worker only covers its shard
+        info.status_topic = f'{info.status_topic}/{worker_id}'
+    mqtt_client = MQTTClient(info, keepalive=options['keepalive']).connect()
+    cache_path = options['cache_path']
+    if cache_path is not None:
+        cache_path = f'{cache_path}.{worker_id}'
+    fleet = Fleet(cache_path=cache_path)
+    fleet.data = {'devices': descriptions}
+    devices = fleet.build(mqtt_client)
+    if setup is not None:
+        setup(devices, mqtt_client)
+    for device in devices:
+        device.send_config()
+        device.subscribe()
+    asyncio.run(worker_loop(worker_id, mqtt_client, devices, queue, options))
+
+
+class Worker:
+    """The supervisor side state of a worker"""
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.process = None
+        self.shard = []
+        self.restarts = []  # monotonic time of restarts
+        self.restart_at = None
+        self.failed = False
+        self.report = None
+        self.reported_at = None
+        self.rate_in = 0.0
+        self.rate_out = 0.0
+
+    def alive(self):
+        """whether the process is running"""
+        return self.process is not None and self.process.is_alive()
+
+    def update(self, report):
+        """record a report and compute the throughput"""
+        old = self.report
+        if old is not None and old['pid'] == report['pid'] and report['time'] > old['time']:
+            seconds = report['time'] - old['time']
+            self.rate_in = (report['totals']['messages_in'] - old['totals']['messages_in']) / seconds
+            self.rate_out = (report['totals']['messages_out'] - old['totals']['messages_out']) / seconds
+        else:
+            self.rate_in = self.rate_out = 0.0
+        self.report = report
+        self.reported_at = monotonic()
+
+
+class Gateway:
+    """
+    A supervisor of worker processes
+    """
+
+    def __init__(self, info: MQTTInfo, fleet: Fleet, workers=None, setup=None, sleep=1, keepalive=60,
+                 report_interval=5, max_restarts=5, restart_window=60, restart_delay=1, start_method=None):
+        """
+        :param info: :py:class:`hass_mqtt.MQTTInfo`, whose client_id is the prefix of those of workers
+        :param fleet: the description of devices
+        :param workers: number of workers. None for the number of CPUs.
+        :param setup: see :py:func:`run_worker`
+        :param sleep: seconds between pushing states
+        :param keepalive: MQTT keepalive of workers
+        :param report_interval: seconds between reports of workers
+        :param max_restarts: give up a worker restarted so many times within restart_window
+        :param restart_window: seconds
+        :param restart_delay: seconds to wait before restarting a worker
+        :param start_method: start method of multiprocessing
+        """
+        self.info = info
+        self.fleet = fleet.validate()
+        self.setup = setup
+        self.options = {
+            'sleep': sleep,
+            'keepalive': keepalive,
+            'report_interval': report_interval,
+            'cache_path': fleet.cache_path,
+        }
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.restart_delay = restart_delay
+        self.context = multiprocessing.get_context(start_method)
+        self.queue = self.context.Queue()
+        self.workers = {}
+        self.running = False
+        self.resize(workers or os.cpu_count() or 1)
+
+    def live_workers(self):
+        """ids of workers not given up, i.e., without quarantined devices"""
+        return [worker_id for worker_id, worker in self.workers.items() if not worker.failed]
+
+    def resize(self, number):
+        """
+        Change the number of workers and rebalance devices
+
+        :param number: number of workers
+        :return: self
+        """
+        for worker_id in range(number):
+            if worker_id not in self.workers:
+                self.workers[worker_id] = Worker(worker_id)
+        for worker_id in list(self.workers):
+            if worker_id >= number:
+                self.stop_worker(self.workers.pop(worker_id))
+        return self.rebalance()
+
+    def rebalance(self):
+        """
+        reassign devices to workers and restart those whose shards change. Devices
+        of a failed worker stay quarantined with it.
+        """
+        shards = assign(self.fleet.devices, list(self.workers))
+        for worker_id, shard in shards.items():
+            worker = self.workers[worker_id]
+            if worker.shard == shard:
+                continue
+            worker.shard = shard
+            if self.running and not worker.failed:
+                self.stop_worker(worker)
+                self.spawn(worker)
+        return self
+
+    def quarantined(self):
+        """serial numbers of devices of failed workers"""
+        return [desc['device']['serial_number']
+                for worker in self.workers.values() if worker.failed
+                for desc in worker.shard]
+
+    def retry(self, worker_id):
+        """
+        Give a failed worker another chance, e.g., after fixing its devices
+
+        :param worker_id: the worker id
+        :return: self
+        """
+        worker = self.workers[worker_id]
+        worker.failed = False
+        worker.restarts = []
+        if self.running:
+            self.spawn(worker)
+        return self
+
+    def spawn(self, worker):
+        """start the process of a worker"""
+        worker.restart_at = None
+        if not worker.shard:
+            return
+        process = self.context.Process(
+            target=run_worker,
+            args=(worker.worker_id, dict(self.info.data), worker.shard, self.queue, self.setup, self.options),
+            name=f'hass_mqtt-{worker.worker_id}',
+            daemon=True,
+        )
+        process.start()
+        worker.process = process
+
+    @staticmethod
+    def stop_worker(worker, timeout=5):
+        """stop the process of a worker"""
+        process = worker.process
+        worker.process = None
+        worker.report = None
+        if process is None:
+            return
+        process.terminate()
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def start(self):
+        """start all workers"""
+        self.running = True
+        for worker_id in self.live_workers():
+            self.spawn(self.workers[worker_id])
+        return self
+
+    def stop(self):
+        """stop all workers"""
+        self.running = False
+        for worker in self.workers.values():
+            self.stop_worker(worker)
+        return self
+
+    def collect(self):
+        """read reports of workers"""
+        while True:
+            try:
+                report = self.queue.get_nowait()
+            except Empty:
+                return
+            worker = self.workers.get(report['worker'])
+            if worker is not None and worker.process is not None and worker.process.pid == report['pid']:
+                worker.update(report)
+
+    def crashed(self, worker):
+        """schedule a restart of a crashed worker, or give it up"""
+        process = worker.process
+        worker.process = None
+        worker.report = None
+        process.join()
+        current = monotonic()
+        worker.restarts = [x for x in worker.restarts if current - x < self.restart_window]
+        if len(worker.restarts) >= self.max_restarts:
+            # quarantine its devices instead of passing a poison device on
+            worker.failed = True
+            return
+        worker.restarts.append(current)
+        worker.restart_at = current + self.restart_delay
+
+    def check(self):
+        """collect reports, and restart crashed workers"""
+        self.collect()
+        current = monotonic()
+        for worker in list(self.workers.values()):
+            if worker.failed:
+                continue
+            if worker.process is not None and not worker.process.is_alive():
+                self.crashed(worker)
+            elif worker.restart_at is not None and current >= worker.restart_at:
+                self.spawn(worker)
+        return self
+
+    def run(self, tick=0.5):
+        """start workers and supervise them until interrupted"""
+        self.start()
+        try:
+            while self.running:
+                self.check()
+                time.sleep(tick)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def health(self):
+        """
+        Health and throughput of workers
+
+        :return: a json serializable dict of workers and totals over them
+        """
+        stale = 3 * self.options['report_interval']
+        current = monotonic()
+        workers = {}
+        totals = dict.fromkeys(COUNTERS, 0)
+        totals.update({'devices': 0, 'workers': 0, 'quarantined': 0, 'msgs_in_per_sec': 0.0, 'msgs_out_per_sec': 0.0})
+        for worker_id, worker in self.workers.items():
+            data = {
+                'alive': worker.alive(),
+                'failed': worker.failed,
+                'pid': None if worker.process is None else worker.process.pid,
+                'devices': len(worker.shard),
+                'restarts': len(worker.restarts),
+                'stale': worker.reported_at is None or current - worker.reported_at > stale,
+                'msgs_in_per_sec': worker.rate_in,
+                'msgs_out_per_sec': worker.rate_out,
+                'totals': None,
+            }
+            if data['alive']:
+                totals['workers'] += 1
+                totals['devices'] += data['devices']
+            if worker.failed:
+                totals['quarantined'] += data['devices']
+            if worker.report is not None:
+                report = worker.report['totals']
+                data['totals'] = report
+                for key in COUNTERS:
+                    totals[key] += report[key]
+                totals['msgs_in_per_sec'] += worker.rate_in
+                totals['msgs_out_per_sec'] += worker.rate_out
+            workers[worker_id] = data
+        return {'workers': workers, 'totals': totals}
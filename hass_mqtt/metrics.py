@@ -0,0 +1,200 @@
+"""
+Runtime metrics of an :py:class:`hass_mqtt.MQTTClient`: per-topic message
+counts, bytes, errors and callback latency histograms with fixed buckets, as
+well as the latency of component reads. Recording is a few additions per
+message, so it is always on. Devices also record the latency from receiving
+a command to publishing the resulting state.
+"""
+
+# now is the clock of all metrics, imported from here by the other modules
+try:
+    from time import perf_counter as now  # pylint: disable=unused-import
+except ImportError:
+    from time import time as now  # pylint: disable=unused-import
+
+# upper bounds of latency buckets in seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# key of the totals -> name and unit of its diagnostic sensor
+SENSORS = {
+    'messages_in': ('Messages received', None),
+    'messages_out': ('Messages sent', None),
+    'bytes_in': ('Bytes received', 'B'),
+    'bytes_out': ('Bytes sent', 'B'),
+    'errors': ('Callback errors', None),
+    'latency_p95': ('Callback latency p95', 's'),
+}
+
+
+class Histogram:
+    """A histogram with fixed buckets. The last count is for overflows."""
+    __slots__ = ('buckets', 'counts', 'count', 'total')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        """record a value"""
+        self.count += 1
+        self.total += value
+        i = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            i += 1
+        self.counts[i] += 1
+
+    def quantile(self, q):
+        """the upper bound of the bucket containing the q quantile, capped at the last bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def snapshot(self):
+        """a json serializable snapshot"""
+        return {
+            'buckets': list(self.buckets),
+            'counts': list(self.counts),
+            'count': self.count,
+            'sum': self.total,
+        }
+
+
+class Stats:
+    """counts, errors and latency of some operation"""
+    __slots__ = ('count', 'errors', 'latency')
+
+    def __init__(self, buckets=BUCKETS):
+        self.count = 0
+        self.errors = 0
+        self.latency = Histogram(buckets)
+
+    def snapshot(self):
+        """a json serializable snapshot"""
+        return {'count': self.count, 'errors': self.errors, 'latency': self.latency.snapshot()}
+
+
+class TopicStats(Stats):
+    """statistics of an MQTT topic. count is the number of received messages"""
+    __slots__ = ('bytes_in', 'messages_out', 'bytes_out')
+
+    def __init__(self, buckets=BUCKETS):
+        super().__init__(buckets)
+        self.bytes_in = 0
+        self.messages_out = 0
+        self.bytes_out = 0
+
+    def snapshot(self):
+        data = super().snapshot()
+        data['messages_in'] = data.pop('count')
+        data['bytes_in'] = self.bytes_in
+        data['messages_out'] = self.messages_out
+        data['bytes_out'] = self.bytes_out
+        return data
+
+
+def topic_name(topic):
+    """topics are received in bytes but often published in str"""
+    if isinstance(topic, bytes):
+        return topic.decode()
+    return topic
+
+
+class Metrics:
+    """
+    The registry of statistics. Topic statistics are recorded by
+    :py:class:`hass_mqtt.MQTTClient` and read statistics by
+    :py:class:`hass_mqtt.components.Base`.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.topics = {}
+        self.reads = {}
+        self.echoes = {}
+        self.sensors = {}
+
+    def topic(self, topic) -> TopicStats:
+        """statistics of a topic"""
+        stats = self.topics.get(topic)
+        if stats is None:
+            stats = self.topics[topic] = TopicStats(self.buckets)
+        return stats
+
+    def read(self, name) -> Stats:
+        """statistics of reading a component"""
+        stats = self.reads.get(name)
+        if stats is None:
+            stats = self.reads[name] = Stats(self.buckets)
+        return stats
+
+    def echo(self, name) -> Stats:
+        """statistics of state echoes of a device, i.e., command received to state published"""
+        stats = self.echoes.get(name)
+        if stats is None:
+            stats = self.echoes[name] = Stats(self.buckets)
+        return stats
+
+    def totals(self):
+        """sum over all topics"""
+        latency = Histogram(self.buckets)
+        totals = {'messages_in': 0, 'bytes_in': 0, 'messages_out': 0, 'bytes_out': 0, 'errors': 0}
+        stats: TopicStats
+        for stats in self.topics.values():
+            totals['messages_in'] += stats.count
+            totals['bytes_in'] += stats.bytes_in
+            totals['messages_out'] += stats.messages_out
+            totals['bytes_out'] += stats.bytes_out
+            totals['errors'] += stats.errors
+            latency.count += stats.latency.count
+            latency.total += stats.latency.total
+            latency.counts = [a + b for a, b in zip(latency.counts, stats.latency.counts)]
+        totals['latency'] = latency
+        return totals
+
+    def snapshot(self):
+        """a json serializable snapshot of all statistics"""
+        topics = {}
+        for topic, stats in self.topics.items():
+            data = stats.snapshot()
+            name = topic_name(topic)
+            if name in topics:  # the same topic in both str and bytes
+                old = topics[name]
+                for key in ('messages_in', 'bytes_in', 'messages_out', 'bytes_out', 'errors'):
+                    data[key] += old[key]
+                old_latency = old['latency']
+                latency = data['latency']
+                latency['count'] += old_latency['count']
+                latency['sum'] += old_latency['sum']
+                latency['counts'] = [a + b for a, b in zip(latency['counts'], old_latency['counts'])]
+            topics[name] = data
+        totals = self.totals()
+        totals['latency'] = totals['latency'].snapshot()
+        return {
+            'topics': topics,
+            'reads': {name: stats.snapshot() for name, stats in self.reads.items()},
+            'echoes': {name: stats.snapshot() for name, stats in self.echoes.items()},
+            'totals': totals,
+        }
+
+    def update_sensors(self):
+        """
+        set the values of the sensors added by
+        :py:meth:`hass_mqtt.Device.add_metric_sensors`
+        """
+        if not self.sensors:
+            return self
+        totals = self.totals()
+        totals['latency_p95'] = totals.pop('latency').quantile(0.95)
+        for key, target in self.sensors.items():
+            target.value = totals[key]
+        return self
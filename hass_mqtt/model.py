@@ -4,10 +4,7 @@ A model is just a key-value dict. I provide
 the :py:class:`Field` class to access the dict data
 easily.
 """
-try:
-    import ujson as json
-except ImportError:
-    import json
+from . import serializer
 
 
 class DefaultFactory:
@@ -40,6 +37,8 @@ class Field:
     def __init__(self, name=None, default=None, cast=None):
         self.name = name
         self.default = default
+        # skip calling the cast on reading
+        self.plain = cast is None
         if cast is None:
             cast = self.default_cast
         self.cast = cast
@@ -48,13 +47,24 @@ class Field:
         if self.name is None:
             self.name = name
 
+    def make_default(self):
+        """make the default value"""
+        default = self.default
+        if isinstance(default, DefaultFactory):
+            default = default()
+        return default
+
     def __get__(self, instance, owner):
         if instance is None:
             return self
-        default = self.default
-        if isinstance(self.default, DefaultFactory):
-            default = default()
-        value = instance.data.setdefault(self.name, default)
+        data = instance.data
+        try:
+            value = data[self.name]
+        except KeyError:
+            # materialize the default once
+            value = data[self.name] = self.make_default()
+        if self.plain:
+            return value
         return self.cast(value)
 
     def __set__(self, instance, value):
@@ -115,16 +125,17 @@ class Config(Model):
     Naturally, a json file can contain a :py:class:`dict`. This
     class is provided for loading a json into data
     """
-    def __init__(self, file_path) -> None:
+    def __init__(self, file_path=None) -> None:
         super().__init__()
-        self.load(file_path)
+        if file_path is not None:
+            self.load(file_path)
 
     def load(self, file_path):
         """Load a json file."""
-        with open(file_path, 'r') as file:
-            self.data = json.load(file)
+        with open(file_path, 'rb') as file:
+            self.data = serializer.loads(file.read())
 
     def save(self, file_path):
         """Save to a json file."""
-        with open(file_path, 'w') as file:
-            json.dump(self.data, file)
+        with open(file_path, 'wb') as file:
+            file.write(serializer.dumps(self.data))
@@ -0,0 +1,318 @@
+"""
+This provides an outbound queue of an :py:class:`hass_mqtt.MQTTClient`. Publishing
+only enqueues the packet, while a background coroutine writes queued packets in
+batches once the socket is writable, so a slow broker does not stall the event loop.
+
+Packets wait in priority lanes, see :py:mod:`hass_mqtt.ratelimit`, and the rate of
+writing can be limited globally and per topic with token buckets.
+"""
+from collections import deque
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from .packet import publish_packet
+from .metrics import Histogram
+from .ratelimit import TokenBucket, LANES, STATE, monotonic
+
+
+class Outbox:
+    """
+    A bounded queue of PUBLISH packets. For topics published with coalesce,
+    e.g., state topics, only the latest pending payload is kept.
+    """
+
+    def __init__(self, mqtt_client, maxsize=1024, batch_bytes=16384):
+        """
+        :param mqtt_client: the :py:class:`hass_mqtt.MQTTClient` owning the socket
+        :param maxsize: maximum number of pending packets
+        :param batch_bytes: maximum bytes written at a time
+        """
+        self.mqtt_client = mqtt_client
+        self.maxsize = maxsize
+        self.batch_bytes = batch_bytes
+        # a queue per priority. entries are [topic, msg, retain, qos, enqueued, priority, coalesce]
+        self.lanes = [deque() for _ in LANES]
+        self.size = 0
+        # entries of the batch being written, requeued if the write fails
+        self.taken = []
+        # topic -> pending coalesced entry
+        self.latest = {}
+        self.ready = asyncio.Event()
+        self.space = asyncio.Event()
+        self.space.set()
+        # rate limits
+        self.limit = None
+        self.topic_limit = None
+        self.topic_limits = {}
+        self.buckets = {}
+        # seconds until a limited packet may be written
+        self.wait = None
+        # statistics
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.errors = 0
+        self.latency = Histogram()
+
+    @property
+    def depth(self):
+        """number of pending packets"""
+        return self.size
+
+    def full(self):
+        """whether the queue is full"""
+        return self.size >= self.maxsize
+
+    def set_limit(self, rate, burst=None):
+        """
+        Limit the number of packets written per second
+
+        :param rate: packets per second. None for no limit.
+        :param burst: packets allowed at once
+        :return: self
+        """
+        self.limit = None if rate is None else TokenBucket(rate, burst)
+        return self
+
+    def set_topic_limit(self, rate, burst=None, topic=None):
+        """
+        Limit the number of packets per second of each topic
+
+        :param rate: packets per second. None for no limit.
+        :param burst: packets allowed at once
+        :param topic: only limit this topic, overriding the limit of all topics
+        :return: self
+        """
+        limit = None if rate is None else (rate, burst)
+        if topic is None:
+            self.topic_limit = limit
+        elif limit is None:
+            self.topic_limits.pop(topic, None)
+        else:
+            self.topic_limits[topic] = limit
+        self.buckets.clear()
+        return self
+
+    def bucket(self, topic):
+        """the token bucket of a topic or None"""
+        bucket = self.buckets.get(topic)
+        if bucket is None:
+            limit = self.topic_limits.get(topic, self.topic_limit)
+            if limit is None:
+                return None
+            bucket = self.buckets[topic] = TokenBucket(*limit)
+        return bucket
+
+    def queue_latency(self):
+        """seconds waited by the oldest pending packet of each lane"""
+        current = monotonic()
+        return {name: current - lane[0][4] if lane else 0.0 for name, lane in zip(LANES, self.lanes)}
+
+    def stats(self):
+        """a snapshot of statistics"""
+        return {
+            'depth': self.size,
+            'lanes': {name: len(lane) for name, lane in zip(LANES, self.lanes)},
+            'maxsize': self.maxsize,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'batches': self.batches,
+            'errors': self.errors,
+            'limit': None if self.limit is None else self.limit.snapshot(),
+            'topic_limit': None if self.topic_limit is None else dict(zip(('rate', 'burst'), self.topic_limit)),
+            'topic_limits': {topic: {'rate': rate, 'burst': burst}
+                             for topic, (rate, burst) in self.topic_limits.items()},
+            'queue_latency': self.queue_latency(),
+            'latency': self.latency.snapshot(),
+        }
+
+    def enqueue(self, topic, msg, retain=False, qos=0, coalesce=False, priority=STATE):
+        """
+        Enqueue a message if there is space
+
+        :return: whether the message is enqueued or not
+        """
+        if coalesce:
+            entry = self.latest.get(topic)
+            if entry is not None:
+                entry[1] = msg
+                entry[2] = retain
+                entry[3] = qos
+                if priority < entry[5]:  # promote, e.g., a heartbeat becoming a change
+                    self.lanes[entry[5]].remove(entry)
+                    self.lanes[priority].append(entry)
+                    entry[5] = priority
+                self.coalesced += 1
+                return True
+        if self.size >= self.maxsize:
+            self.space.clear()
+            return False
+        entry = [topic, msg, retain, qos, monotonic(), priority, coalesce]
+        self.lanes[priority].append(entry)
+        self.size += 1
+        if coalesce:
+            self.latest[topic] = entry
+        self.ready.set()
+        return True
+
+    def put(self, topic, msg, retain=False, qos=0, coalesce=False, priority=STATE):
+        """
+        Enqueue a message without waiting
+
+        :return: False if the queue is full and the message is dropped
+        """
+        if self.enqueue(topic, msg, retain, qos, coalesce, priority):
+            return True
+        self.dropped += 1
+        return False
+
+    async def put_wait(self, topic, msg, retain=False, qos=0, coalesce=False, priority=STATE):
+        """Enqueue a message, waiting while the queue is full"""
+        while not self.enqueue(topic, msg, retain, qos, coalesce, priority):
+            await self.space.wait()
+
+    def take(self):
+        """
+        pop pending packets up to batch_bytes and the rate limits, in order of
+        priority, and join them. Packets of a limited topic are skipped until
+        the topic has tokens.
+        """
+        current = monotonic()
+        self.taken = []
+        self.wait = None
+        packets = []
+        size = 0
+        for lane in self.lanes:
+            size, blocked = self.take_lane(lane, current, packets, size)
+            if blocked or size >= self.batch_bytes:
+                break
+        self.size -= len(packets)
+        self.sent += len(packets)
+        return b''.join(packets)
+
+    def take_lane(self, lane, current, packets, size):
+        """
+        pop the packets of one lane into packets, see :py:meth:`take`
+
+        :return: the size of packets and whether the global limit blocks
+        """
+        limit = self.limit
+        held = []
+        blocked = False
+        while lane and size < self.batch_bytes:
+            if limit is not None:
+                delay = limit.delay(current)
+                if delay:
+                    self.wait = delay
+                    blocked = True
+                    break
+            entry = lane.popleft()
+            topic = entry[0]
+            bucket = self.bucket(topic)
+            if bucket is not None:
+                delay = bucket.delay(current)
+                if delay:
+                    held.append(entry)
+                    if self.wait is None or delay < self.wait:
+                        self.wait = delay
+                    continue
+                bucket.consume()
+            if limit is not None:
+                limit.consume()
+            if self.latest.get(topic) is entry:
+                del self.latest[topic]
+            packet = publish_packet(*entry[:4])
+            self.taken.append(entry)
+            packets.append(packet)
+            size += len(packet)
+            self.latency.observe(current - entry[4])
+        if held:
+            lane.extendleft(reversed(held))
+        return size, blocked
+
+    def requeue(self):
+        """put the entries of the last batch back in front of their lanes"""
+        taken = self.taken
+        self.taken = []
+        for entry in reversed(taken):
+            self.lanes[entry[5]].appendleft(entry)
+            if entry[6]:
+                self.latest.setdefault(entry[0], entry)
+        self.size += len(taken)
+        self.sent -= len(taken)
+
+    def handoff(self):
+        """
+        Move all pending packets to the spool of the client, which forwards them
+        in order after reconnecting
+
+        :return: number of packets moved
+        """
+        mqtt_client = self.mqtt_client
+        count = self.size
+        for lane in self.lanes:
+            while lane:
+                topic, msg, retain, qos, _, _, _ = lane.popleft()
+                mqtt_client.forward(topic, msg, retain, qos)
+        self.latest.clear()
+        self.size = 0
+        self.space.set()
+        return count
+
+    def failed(self):
+        """
+        Recover from a failed write. The batch is requeued, then either handed to
+        the spool of the client if any, or kept while umqtt.robust reconnects.
+        """
+        self.errors += 1
+        self.requeue()
+        mqtt_client = self.mqtt_client
+        if mqtt_client.spool is not None:
+            mqtt_client.lost()
+            self.handoff()
+        else:
+            mqtt_client.reconnect()
+
+    async def writable(self):
+        """wait until the socket is writable"""
+        event_loop = asyncio.get_event_loop()
+        if not hasattr(event_loop, 'add_writer'):
+            return
+        fd = self.mqtt_client.client.sock.fileno()
+        if fd < 0:  # closed, the write fails and recovers
+            return
+        future = event_loop.create_future()
+        event_loop.add_writer(fd, lambda: future.done() or future.set_result(None))
+        try:
+            await future
+        finally:
+            event_loop.remove_writer(fd)
+
+    async def flush(self):
+        """write all pending packets, sleeping while they are rate limited"""
+        while self.size:
+            await self.writable()
+            data = self.take()
+            if not data:
+                await asyncio.sleep(self.wait or 0)
+                continue
+            self.batches += 1
+            try:
+                self.mqtt_client.write(data)
+            except OSError:
+                self.failed()
+                continue
+            self.taken = []
+            self.space.set()
+
+    async def run(self):
+        """write packets whenever there are some"""
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            await self.flush()
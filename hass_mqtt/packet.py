@@ -0,0 +1,95 @@
+"""
+Encoding of MQTT 3.1.1 packets, used when packets are written without going
+through umqtt, e.g., batched writes of :py:class:`hass_mqtt.outbox.Outbox`.
+"""
+
+PUBLISH = 0x30
+PUBACK = 0x40
+SUBSCRIBE = 0x82
+SUBACK = 0x90
+DUP = 0x08
+
+
+def encode_length(size):
+    """encode the remaining length"""
+    out = bytearray()
+    while True:
+        byte = size & 0x7F
+        size >>= 7
+        if size:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def encode_str(data):
+    """encode a string with its length"""
+    if isinstance(data, str):
+        data = data.encode()
+    return len(data).to_bytes(2, 'big') + data
+
+
+def publish_header(retain=False, qos=0, dup=False):
+    """the first byte of PUBLISH"""
+    header = PUBLISH | qos << 1 | retain
+    if dup:
+        header |= DUP
+    return header
+
+
+def publish_packet(topic, msg, retain=False, qos=0, pid=0, dup=False):
+    """
+    Encode a PUBLISH packet
+
+    :param topic: topic in str or bytes
+    :param msg: payload in bytes
+    :param retain: MQTT retain
+    :param qos: MQTT qos
+    :param pid: packet id used when qos > 0
+    :param dup: DUP flag of retransmission
+    :return: the packet in bytes
+    """
+    variable = encode_str(topic)
+    if qos > 0:
+        variable += pid.to_bytes(2, 'big')
+    size = len(variable) + len(msg)
+    return bytes((publish_header(retain, qos, dup),)) + encode_length(size) + variable + msg
+
+
+class PublishPlan:
+    """
+    A precompiled qos 0 PUBLISH of a topic. The first byte and the encoded topic
+    are kept, so publishing only encodes the remaining length of the payload.
+    """
+    __slots__ = ('topic', 'retain', 'qos', 'header', 'encoded_topic')
+
+    def __init__(self, topic, retain=False):
+        self.topic = topic
+        self.retain = retain
+        self.qos = 0
+        self.header = bytes((publish_header(retain),))
+        self.encoded_topic = encode_str(topic)
+
+    def matches(self, topic, retain=False, qos=0):
+        """whether the plan is still valid"""
+        return qos == 0 and retain == self.retain and topic == self.topic
+
+    def buffers(self, msg):
+        """the PUBLISH as a list of buffers without concatenating the payload"""
+        encoded_topic = self.encoded_topic
+        return [self.header + encode_length(len(encoded_topic) + len(msg)), encoded_topic, msg]
+
+
+def subscribe_packet(pid, topics, qos=0):
+    """
+    Encode a SUBSCRIBE packet with several topic filters
+
+    :param pid: packet id
+    :param topics: topic filters in str or bytes
+    :param qos: requested qos of all filters
+    :return: the packet in bytes
+    """
+    payload = b''.join(encode_str(topic) + bytes((qos,)) for topic in topics)
+    size = 2 + len(payload)
+    return bytes((SUBSCRIBE,)) + encode_length(size) + pid.to_bytes(2, 'big') + payload
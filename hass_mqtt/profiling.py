@@ -0,0 +1,227 @@
+"""
+Profiling hooks that can be switched on at runtime. :py:class:`hass_mqtt.MQTTClient`
+calls its tracer, if any, around publishing and dispatching messages, and
+components call it around reads and writes. A :py:class:`Profiler` listens on a
+reserved command topic, e.g.,
+
+.. code-block:: python
+
+    Profiler(mqtt_client, 'gateway/profile/set', report_topic='gateway/profile/report')
+
+Then publishing `start`, `start profile` or `start sampling` to the topic starts
+a tracer, and `stop` stops it and publishes or writes the report.
+"""
+import sys
+import threading
+
+from . import serializer
+from .metrics import Histogram, now
+
+
+class Tracer:
+    """
+    The interface of tracers. A hook calls `token = tracer.enter(name)` before
+    the traced operation and `tracer.exit(name, token)` after it.
+    """
+
+    def start(self):
+        """start tracing"""
+
+    def stop(self):
+        """stop tracing"""
+
+    def enter(self, name):
+        """an operation starts"""
+
+    def exit(self, name, token):
+        """an operation ends"""
+
+    def report(self):
+        """the report in str"""
+        return ''
+
+
+class SpanTracer(Tracer):
+    """timing spans of operations in histograms"""
+
+    def __init__(self):
+        self.spans = {}
+
+    def enter(self, name):
+        return now()
+
+    def exit(self, name, token):
+        histogram = self.spans.get(name)
+        if histogram is None:
+            histogram = self.spans[name] = Histogram()
+        histogram.observe(now() - token)
+
+    def report(self):
+        spans = {}
+        for name, histogram in self.spans.items():
+            data = histogram.snapshot()
+            data['p50'] = histogram.quantile(0.5)
+            data['p99'] = histogram.quantile(0.99)
+            spans[name] = data
+        return serializer.dumps({'spans': spans}).decode()
+
+
+class ProfileTracer(Tracer):
+    """cProfile of the whole thread while started"""
+
+    def __init__(self, sort='cumulative', limit=50):
+        # pylint: disable=import-outside-toplevel
+        import cProfile
+        self.profile = cProfile.Profile()
+        self.sort = sort
+        self.limit = limit
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def report(self):
+        # pylint: disable=import-outside-toplevel
+        import io
+        import pstats
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats(self.sort).print_stats(self.limit)
+        return out.getvalue()
+
+
+class SamplingTracer(Tracer):
+    """
+    Sample the stack of the traced thread periodically in a background thread.
+    The report is in the collapsed format of flame graphs, i.e., `a;b;c count`.
+    """
+
+    def __init__(self, interval=0.005, thread_id=None):
+        """
+        :param interval: seconds between samples
+        :param thread_id: the traced thread. None for the thread calling start.
+        """
+        self.interval = interval
+        self.thread_id = thread_id
+        self.samples = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name='hass_mqtt-sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """take samples until stopped"""
+        samples = self.samples
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            samples[key] = samples.get(key, 0) + 1
+
+    def report(self):
+        lines = sorted(self.samples.items(), key=lambda x: -x[1])
+        return '\n'.join(f'{stack} {count}' for stack, count in lines)
+
+
+TRACERS = {
+    'spans': SpanTracer,
+    'profile': ProfileTracer,
+    'sampling': SamplingTracer,
+}
+
+
+class Profiler:
+    """
+    Switch the tracer of a client with commands on a reserved topic:
+    `start [kind]`, where kind is a key of tracers (spans by default), `stop`,
+    and `report` to send the report of the running tracer.
+    """
+
+    def __init__(self, mqtt_client, command_topic, report_topic=None, report_path=None, tracers=None):
+        """
+        :param mqtt_client: the :py:class:`hass_mqtt.MQTTClient`
+        :param command_topic: the reserved command topic
+        :param report_topic: publish reports to this topic
+        :param report_path: write reports to this file
+        :param tracers: a dict from kinds to factories of tracers. None for :py:data:`TRACERS`.
+        """
+        self.mqtt_client = mqtt_client
+        self.command_topic = command_topic
+        self.report_topic = report_topic
+        self.report_path = report_path
+        self.tracers = TRACERS if tracers is None else tracers
+        self.reports = 0
+        mqtt_client.subscribe(command_topic, self.on_command)
+
+    @property
+    def tracer(self) -> Tracer:
+        """the running tracer"""
+        return self.mqtt_client.tracer
+
+    def on_command(self, msg):
+        """callback of the command topic. Unknown commands are ignored."""
+        command, _, kind = msg.decode().strip().partition(' ')
+        if command == 'start':
+            self.start(kind or 'spans')
+        elif command == 'stop':
+            self.stop()
+        elif command == 'report' and self.tracer is not None:
+            # tracers may only report while stopped, e.g., cProfile
+            tracer = self.tracer
+            tracer.stop()
+            self.send_report(tracer)
+            tracer.start()
+
+    def start(self, kind='spans'):
+        """
+        Start a tracer, stopping the running one
+
+        :param kind: a key of tracers
+        :return: the tracer or None if the kind is unknown
+        """
+        factory = self.tracers.get(kind)
+        if factory is None:
+            return None
+        self.stop(report=False)
+        tracer = factory()
+        tracer.start()
+        self.mqtt_client.tracer = tracer
+        return tracer
+
+    def stop(self, report=True):
+        """stop the running tracer and send its report"""
+        tracer = self.tracer
+        if tracer is None:
+            return None
+        self.mqtt_client.tracer = None
+        tracer.stop()
+        if report:
+            self.send_report(tracer)
+        return tracer
+
+    def send_report(self, tracer: Tracer):
+        """publish or write the report"""
+        text = tracer.report()
+        self.reports += 1
+        if self.report_path is not None:
+            with open(self.report_path, 'w', encoding='utf-8') as file:
+                file.write(text)
+        if self.report_topic is not None:
+            self.mqtt_client.publish(self.report_topic, text.encode())
+        return text
@@ -0,0 +1,54 @@
+"""
+Token buckets and priority lanes used by :py:class:`hass_mqtt.outbox.Outbox`
+to limit the publish rate of a client.
+"""
+
+try:
+    from time import monotonic
+except ImportError:
+    from time import time as monotonic
+
+# priority lanes, the smaller the earlier
+COMMAND = 0
+STATE = 1
+DISCOVERY = 2
+HEARTBEAT = 3
+LANES = ('command', 'state', 'discovery', 'heartbeat')
+
+
+class TokenBucket:
+    """A token bucket holding at most burst tokens and refilled at rate tokens per second"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: tokens per second
+        :param burst: capacity. None for max(1, rate).
+        """
+        if burst is None:
+            burst = max(1, rate)
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+
+    def refill(self, current):
+        """add tokens accumulated until current"""
+        tokens = self.tokens + (current - self.updated) * self.rate
+        self.tokens = tokens if tokens < self.burst else self.burst
+        self.updated = current
+
+    def delay(self, current):
+        """seconds until a token is available. 0 if there is one now."""
+        self.refill(current)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        """take a token"""
+        self.tokens -= 1
+
+    def snapshot(self):
+        """the configured limit"""
+        return {'rate': self.rate, 'burst': self.burst}
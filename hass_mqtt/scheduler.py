@@ -0,0 +1,146 @@
+"""
+This provides a shared scheduler driving periodic jobs, e.g., reading components
+and pushing states, from a single coroutine. Jobs are kept in a heap ordered by
+their due time, which is rounded up to a tick, so that jobs due in the same tick
+are run together by one wakeup instead of each sleeping on its own timer.
+"""
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+try:
+    from time import monotonic
+except ImportError:
+    from time import time as monotonic
+
+from heapq import heappush, heappop
+
+
+class Job:
+    """A periodic job"""
+
+    def __init__(self, interval, func):
+        self.interval = interval
+        self.func = func
+        self.due = 0
+        self.running = False
+        # the task of a pending async run, referenced until done
+        self.task = None
+        self.cancelled = False
+        self.runs = 0
+        self.errors = 0
+        self.last_error = None
+
+    def cancel(self):
+        """stop the job"""
+        self.cancelled = True
+        return self
+
+    def failed(self, err):
+        """record an error"""
+        self.errors += 1
+        self.last_error = err
+
+    async def wait(self, awaitable):
+        """await the result of an async job"""
+        try:
+            await awaitable
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            self.failed(err)
+        finally:
+            self.running = False
+            self.task = None
+
+
+class Scheduler:
+    """
+    A heap based scheduler. Sync jobs are called in place, while async jobs
+    are spawned as tasks. A job is skipped if its last run is still pending,
+    and an error of one job never stops the others.
+    """
+
+    def __init__(self, tick=0.05):
+        self.tick = tick
+        self.heap = []
+        self.wakeups = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def align(self, due):
+        """round a time up to the tick so that close jobs share a wakeup"""
+        tick = self.tick
+        if not tick:
+            return due
+        ticks = int(due / tick)
+        if ticks * tick < due:
+            ticks += 1
+        return ticks * tick
+
+    def every(self, interval, func, delay=0):
+        """
+        Run func every interval seconds
+
+        :param interval: seconds between two runs
+        :param func: a function or a coroutine function without arguments
+        :param delay: seconds before the first run
+        :return: the :py:class:`Job`
+        """
+        job = Job(interval, func)
+        job.due = self.align(monotonic() + delay)
+        heappush(self.heap, (job.due, id(job), job))
+        return job
+
+    def run_job(self, job: Job):
+        """run a job once"""
+        if job.running:
+            return
+        job.runs += 1
+        try:
+            result = job.func()
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            job.failed(err)
+            return
+        if result is not None and hasattr(result, 'send'):
+            job.running = True
+            job.task = asyncio.create_task(job.wait(result))
+
+    def run_pending(self, now=None):
+        """
+        Run all jobs due before the end of the current tick
+
+        :param now: current time
+        :return: number of jobs run
+        """
+        if now is None:
+            now = monotonic()
+        horizon = now + self.tick
+        heap = self.heap
+        batch = []
+        while heap and heap[0][0] <= horizon:
+            batch.append(heappop(heap)[2])
+        for job in batch:
+            if job.cancelled:
+                continue
+            self.run_job(job)
+            due = job.due + job.interval
+            if due < now:  # skip missed runs instead of bursting
+                due = now + job.interval
+            job.due = self.align(due)
+            heappush(heap, (job.due, id(job), job))
+        return len(batch)
+
+    async def run(self):
+        """run the scheduler forever"""
+        heap = self.heap
+        while True:
+            if heap:
+                delay = heap[0][0] - monotonic()
+            else:
+                delay = self.tick
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.wakeups += 1
+            self.run_pending()
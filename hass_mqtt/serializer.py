@@ -0,0 +1,87 @@
+"""
+The json serializer used by the whole package. The fastest available backend
+among orjson, ujson and the standard json is picked on import, and can be
+changed per process with the `HASS_MQTT_JSON` environment variable or
+:py:func:`use`. Always call through the module, e.g., `serializer.dumps(obj)`,
+so that the configured backend is used.
+
+`dumps` returns bytes, which orjson produces directly without an intermediate str.
+"""
+try:
+    from os import environ
+except ImportError:  # MicroPython
+    environ = {}
+
+
+def make_orjson():
+    """dumps and loads of orjson"""
+    # optional, and a C extension that pylint cannot inspect
+    # pylint: disable=import-outside-toplevel,import-error,no-member
+    import orjson
+
+    def orjson_dumps(obj, sort_keys=False):
+        if sort_keys:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+        return orjson.dumps(obj)
+    return orjson_dumps, orjson.loads
+
+
+def make_ujson():
+    """dumps and loads of ujson"""
+    import ujson  # pylint: disable=import-outside-toplevel,import-error
+
+    def ujson_dumps(obj, sort_keys=False):
+        if sort_keys:
+            return ujson.dumps(obj, sort_keys=True).encode()
+        return ujson.dumps(obj).encode()
+    return ujson_dumps, ujson.loads
+
+
+def make_json():
+    """dumps and loads of the standard json"""
+    import json  # pylint: disable=import-outside-toplevel
+
+    def json_dumps(obj, sort_keys=False):
+        return json.dumps(obj, sort_keys=sort_keys).encode()
+    return json_dumps, json.loads
+
+
+# in order of preference
+BACKENDS = {
+    'orjson': make_orjson,
+    'ujson': make_ujson,
+    'json': make_json,
+}
+
+# name of the backend, dumps(obj, sort_keys=False) -> bytes and loads(bytes or str), set by use.
+# They are rebound by use, so they are not constants.
+# pylint: disable=invalid-name
+backend = None
+dumps = None
+loads = None
+# pylint: enable=invalid-name
+
+
+def use(name=None):
+    """
+    Select the backend
+
+    :param name: a key of :py:data:`BACKENDS`. None for the first available one.
+    :raise ImportError: if the backend is not installed
+    :return: the name of the backend
+    """
+    global backend, dumps, loads  # pylint: disable=global-statement,invalid-name
+    if name is None:
+        for candidate in BACKENDS:
+            try:
+                return use(candidate)
+            except ImportError:
+                continue
+    if name not in BACKENDS:
+        raise ImportError(f'unknown json backend: {name}')
+    dumps, loads = BACKENDS[name]()
+    backend = name
+    return name
+
+
+use(environ.get('HASS_MQTT_JSON') or None)
@@ -0,0 +1,129 @@
+"""
+A bounded on-disk ring log of outgoing MQTT messages, used to store messages
+while the broker is unreachable and forward them after reconnecting. The
+log is a memory-mapped file, so appending costs no system call and the
+messages survive a crash of the process.
+"""
+import mmap
+import os
+import struct
+
+# magic, capacity, head, tail, count
+HEADER = struct.Struct('<4sIQQQ')
+MAGIC = b'HMQS'
+# size of topic and payload, flags, size of topic
+RECORD = struct.Struct('<IBH')
+
+
+class Spool:
+    """
+    A ring log in a file. head and tail are absolute offsets, whose remainders
+    modulo capacity are positions in the data region. When the log is full, the
+    oldest messages are dropped.
+    """
+
+    def __init__(self, file_path, capacity=1 << 24):
+        """
+        :param file_path: path of the log file. An existing log of the same capacity is reused.
+        :param capacity: bytes of the data region
+        """
+        self.file_path = file_path
+        self.capacity = capacity
+        size = HEADER.size + capacity
+        reuse = os.path.exists(file_path) and os.path.getsize(file_path) == size
+        # pylint: disable=consider-using-with
+        self.file = open(file_path, 'r+b' if reuse else 'w+b')
+        if not reuse:
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.head = self.tail = self.count = 0
+        self.dropped = 0
+        magic, stored_capacity, head, tail, count = HEADER.unpack_from(self.map, 0)
+        if reuse and magic == MAGIC and stored_capacity == capacity:
+            self.head, self.tail, self.count = head, tail, count
+        else:
+            self.save_header()
+
+    def __len__(self):
+        return self.count
+
+    def save_header(self):
+        """write head, tail and count"""
+        HEADER.pack_into(self.map, 0, MAGIC, self.capacity, self.head, self.tail, self.count)
+
+    def free(self):
+        """free bytes"""
+        return self.capacity - (self.head - self.tail)
+
+    def write_at(self, offset, data):
+        """write data into the ring"""
+        start = offset % self.capacity
+        first = min(len(data), self.capacity - start)
+        base = HEADER.size
+        self.map[base + start:base + start + first] = data[:first]
+        if first < len(data):
+            self.map[base:base + len(data) - first] = data[first:]
+
+    def read_at(self, offset, size):
+        """read data from the ring"""
+        start = offset % self.capacity
+        first = min(size, self.capacity - start)
+        base = HEADER.size
+        data = self.map[base + start:base + start + first]
+        if first < size:
+            data += self.map[base:base + size - first]
+        return data
+
+    def append(self, topic, msg, retain=False, qos=0):
+        """
+        Append a message, dropping the oldest ones if there is no space
+
+        :return: False if the message is larger than the log
+        """
+        if isinstance(topic, str):
+            topic = topic.encode()
+        size = RECORD.size + len(topic) + len(msg)
+        if size > self.capacity:
+            self.dropped += 1
+            return False
+        while self.free() < size:
+            self.advance(self.peek()[1])
+            self.dropped += 1
+        flags = qos << 1 | bool(retain)
+        self.write_at(self.head, RECORD.pack(len(topic) + len(msg), flags, len(topic)) + topic + msg)
+        self.head += size
+        self.count += 1
+        self.save_header()
+        return True
+
+    def peek(self):
+        """
+        The oldest message
+
+        :return: ((topic, msg, retain, qos), size) or None if empty
+        """
+        if not self.count:
+            return None
+        rest, flags, topic_size = RECORD.unpack(self.read_at(self.tail, RECORD.size))
+        data = self.read_at(self.tail + RECORD.size, rest)
+        message = (data[:topic_size], data[topic_size:], bool(flags & 1), flags >> 1)
+        return message, RECORD.size + rest
+
+    def advance(self, size):
+        """remove the oldest message of size bytes returned by :py:meth:`peek`"""
+        self.tail += size
+        self.count -= 1
+        if not self.count:
+            # restart from the beginning
+            self.head = self.tail = 0
+        self.save_header()
+
+    def sync(self):
+        """flush the log to the disk"""
+        self.map.flush()
+
+    def close(self):
+        """close the file"""
+        self.map.flush()
+        self.map.close()
+        self.file.close()
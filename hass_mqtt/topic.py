@@ -0,0 +1,163 @@
+"""
+This provides a topic trie used to find the callbacks of a received MQTT message.
+Exact topics are kept in a :py:class:`dict`, while filters containing ``+`` or ``#``
+are stored in a trie indexed by topic levels. Thus, matching a topic costs time
+proportional to the number of its levels instead of the number of filters.
+"""
+
+
+class Node:
+    """A level of the trie"""
+    __slots__ = ('children', 'plus', 'hash', 'cbs')
+
+    def __init__(self):
+        self.children = {}
+        self.plus = None  # child node of `+`
+        self.hash = None  # callback list of `#`
+        self.cbs = None  # callback list of filters ending here
+
+    def is_empty(self):
+        """whether the node can be removed or not"""
+        return not self.children and self.plus is None and self.hash is None and self.cbs is None
+
+
+def is_wildcard(topic_filter):
+    """check whether a topic filter contains wildcards"""
+    return b'+' in topic_filter or b'#' in topic_filter
+
+
+class TopicTrie:
+    """
+    Map MQTT topic filters to callback lists. A filter is registered
+    together with its callback list, which is shared rather than copied,
+    so appending to the list later is also seen by the trie.
+    """
+
+    def __init__(self):
+        self.exact = {}
+        self.root = Node()
+        self.wildcards = 0
+
+    def __len__(self):
+        return len(self.exact) + self.wildcards
+
+    def insert(self, topic_filter, cbs):
+        """
+        Register a callback list under some topic filter
+
+        :param topic_filter: MQTT topic filter in bytes
+        :param cbs: a list of callbacks
+        :return: cbs
+        """
+        if not is_wildcard(topic_filter):
+            self.exact[topic_filter] = cbs
+            return cbs
+        node = self.root
+        levels = topic_filter.split(b'/')
+        last = len(levels) - 1
+        for i, level in enumerate(levels):
+            if level == b'#':
+                if i != last:
+                    raise ValueError(f'# must be the last level: {topic_filter}')
+                if node.hash is None:
+                    self.wildcards += 1
+                node.hash = cbs
+                return cbs
+            if level == b'+':
+                if node.plus is None:
+                    node.plus = Node()
+                node = node.plus
+            else:
+                if b'+' in level or b'#' in level:
+                    raise ValueError(f'wildcards must occupy a whole level: {topic_filter}')
+                child = node.children.get(level)
+                if child is None:
+                    child = node.children[level] = Node()
+                node = child
+        if node.cbs is None:
+            self.wildcards += 1
+        node.cbs = cbs
+        return cbs
+
+    def remove(self, topic_filter):
+        """Remove a topic filter. Nothing happens if it is not registered."""
+        if not is_wildcard(topic_filter):
+            self.exact.pop(topic_filter, None)
+            return
+        path = []
+        node = self.root
+        for level in topic_filter.split(b'/'):
+            if level == b'#':
+                if node.hash is not None:
+                    node.hash = None
+                    self.wildcards -= 1
+                break
+            path.append((node, level))
+            node = node.plus if level == b'+' else node.children.get(level)
+            if node is None:
+                return
+        else:
+            if node.cbs is None:
+                return
+            node.cbs = None
+            self.wildcards -= 1
+        # prune empty nodes
+        while path and node.is_empty():
+            parent, level = path.pop()
+            if level == b'+':
+                parent.plus = None
+            else:
+                del parent.children[level]
+            node = parent
+
+    def match(self, topic):
+        """
+        Find all callback lists whose filters match a topic
+
+        :param topic: MQTT topic in bytes
+        :return: a list of callback lists
+        """
+        found = []
+        cbs = self.exact.get(topic)
+        if cbs is not None:
+            found.append(cbs)
+        if self.wildcards:
+            self.match_wildcards(topic, found)
+        return found
+
+    def match_wildcards(self, topic, found):
+        """
+        Find the callback lists of wildcard filters matching a topic
+
+        :param topic: MQTT topic in bytes
+        :param found: the list to append them to
+        """
+        levels = topic.split(b'/')
+        # topics beginning with $ are not matched by wildcards at the first level
+        if topic[:1] == b'$':
+            node = self.root.children.get(levels[0])
+            if node is None:
+                return
+            nodes = [node]
+            levels = levels[1:]
+        else:
+            nodes = [self.root]
+        for level in levels:
+            next_nodes = []
+            for node in nodes:
+                if node.hash is not None:
+                    found.append(node.hash)
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+                if node.plus is not None:
+                    next_nodes.append(node.plus)
+            if not next_nodes:
+                return
+            nodes = next_nodes
+        for node in nodes:
+            if node.cbs is not None:
+                found.append(node.cbs)
+            # `a/#` also matches `a`
+            if node.hash is not None:
+                found.append(node.hash)
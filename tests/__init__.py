@@ -0,0 +1,4 @@
+"""
+Behaviour tests of hass_mqtt. umqtt from https://github.com/fduxiao/umqtt_python
+is required, and tests are skipped without it.
+"""
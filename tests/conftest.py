@@ -0,0 +1,50 @@
+"""shared fixtures"""
+import importlib.util
+import sys
+
+import pytest
+
+try:
+    import umqtt.robust  # pylint: disable=unused-import
+except ImportError:
+    # The package imports umqtt on import. Register it without running its
+    # __init__, so that tests of the modules not using umqtt still run.
+    spec = importlib.util.find_spec('hass_mqtt')
+    sys.modules['hass_mqtt'] = importlib.util.module_from_spec(spec)
+
+
+@pytest.fixture
+def broker():
+    """a running :py:class:`benchmarks.broker.FakeBroker`"""
+    pytest.importorskip('umqtt.robust')
+    # pylint: disable=import-outside-toplevel
+    from benchmarks.broker import FakeBroker
+    with FakeBroker() as fake:
+        yield fake
+
+
+@pytest.fixture
+def make_client(broker):  # pylint: disable=redefined-outer-name
+    """a factory of clients connected to the broker, disconnected afterwards"""
+    # pylint: disable=import-outside-toplevel
+    from hass_mqtt import MQTTClient, MQTTInfo
+    clients = []
+
+    def factory(client_id='test', status_topic=None, connect=True):
+        info = MQTTInfo().prop('addr', broker.host).prop('port', broker.port).prop('client_id', client_id)
+        if status_topic is not None:
+            info.prop('status_topic', status_topic)
+        client = MQTTClient(info)
+        # reconnect at once in umqtt.robust
+        client.client.DELAY = 0
+        clients.append(client)
+        if connect:
+            client.connect(clean_session=True)
+        return client
+
+    yield factory
+    for client in clients:
+        try:
+            client.client.disconnect()
+        except OSError:
+            pass
@@ -0,0 +1,157 @@
+"""MQTTClient against the fake broker"""
+import asyncio
+
+import pytest
+
+pytest.importorskip('umqtt.robust')
+
+# pylint: disable=wrong-import-position
+from hass_mqtt import MQTTClient
+from benchmarks.broker import Handler
+
+
+def drop(client: MQTTClient):
+    """break the connection of a client as a broker restart would"""
+    client.client.sock.close()
+
+
+def test_publish_plan(broker, make_client):
+    client = make_client()
+    plan = client.compile_plan(b'test/state')
+    broker.expect(3)
+    for i in range(3):
+        assert client.publish_plan(plan, str(i).encode())
+    assert broker.wait(5)
+
+
+def test_publish_plan_reconnects(broker, make_client):
+    client = make_client()
+    received = []
+    client.subscribe(b'test/cmd', received.append)
+    plan = client.compile_plan(b'test/state')
+    old = client.client.sock
+    drop(client)
+    broker.expect(1)
+    assert client.publish_plan(plan, b'after')
+    assert broker.wait(5)
+    assert client.client.sock is not old
+    # the subscription is restored on the new connection
+    assert client.sock is client.client.sock
+    assert not client.pending_subacks
+
+
+def test_listen_reads_all(broker, make_client):
+    client = make_client('listener')
+    client.read_batch = 2
+    received = []
+    client.subscribe(b'test/+', received.append)
+    sender = make_client('sender')
+    calls = []
+    check_msg = client.check_msg
+
+    def counting():
+        calls.append(1)
+        return check_msg()
+    client.check_msg = counting
+
+    async def main():
+        task = asyncio.create_task(client.listen())
+        await asyncio.sleep(0.05)
+        for i in range(10):
+            sender.publish(b'test/%d' % i, b'%d' % i)
+        for _ in range(100):
+            if len(received) == 10:
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(main())
+    assert received == [b'%d' % i for i in range(10)]
+    assert len(calls) >= 10
+
+
+def test_pending(make_client):
+    client = make_client()
+    assert not client.pending()
+    client.client.sock.pending = lambda: 3
+    assert client.pending()
+    client.connected = False
+    assert not client.pending()
+
+
+def test_pipelining(broker, make_client):
+    client = make_client().enable_pipelining(window=2)
+    broker.expect(5)
+    for i in range(5):
+        assert client.publish(b'test/q1', b'%d' % i, qos=1)
+    assert broker.wait(5)
+    assert len(client.inflight) <= 2
+
+
+def test_pipelining_resends_lost_puback(monkeypatch, broker, make_client):
+    client = make_client().enable_pipelining(window=1, retry_timeout=0.2)
+    on_puback = Handler.on_puback
+    lost = []
+
+    def lose_first(self, pid):
+        if not lost:
+            lost.append(pid)
+            return
+        on_puback(self, pid)
+
+    monkeypatch.setattr(Handler, 'on_puback', lose_first)
+    broker.expect(3)
+    client.publish(b'test/q1', b'0', qos=1)
+    # waits for the window instead of blocking forever
+    client.publish(b'test/q1', b'1', qos=1)
+    assert broker.wait(5)
+    assert lost
+
+
+def test_pipelining_reconnects(monkeypatch, broker, make_client):
+    client = make_client().enable_pipelining(window=1, retry_timeout=30)
+    monkeypatch.setattr(Handler, 'on_puback', lambda self, pid: None)
+    client.publish(b'test/q1', b'0', qos=1)
+    monkeypatch.undo()
+    old = client.client.sock
+    broker.kick()
+    # the window is full, and the PUBACK only comes after resending on a new connection
+    broker.expect(2)
+    client.publish(b'test/q1', b'1', qos=1)
+    assert broker.wait(5)
+    assert client.client.sock is not old
+
+
+def test_pipelining_broken_socket(broker, make_client):
+    client = make_client().enable_pipelining(window=4)
+    drop(client)
+    broker.expect(1)
+    assert client.publish(b'test/q1', b'0', qos=1)
+    assert broker.wait(5)
+
+
+def test_read_all_yields():
+    client = MQTTClient()
+    client.read_batch = 4
+    ops = iter([0x30] * 10)
+    order = []
+
+    def check_msg():
+        order.append('read')
+        return next(ops, None)
+
+    client.check_msg = check_msg
+    client.pending = lambda: False
+
+    async def other():
+        order.append('other')
+
+    async def main():
+        task = asyncio.create_task(other())
+        await client.read_all()
+        await task
+
+    asyncio.run(main())
+    assert order.count('read') == 11
+    # other tasks run between batches rather than after the stream ends
+    assert order.index('other') == 4
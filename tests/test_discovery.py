@@ -0,0 +1,37 @@
+"""discovery configs and their fingerprints"""
+import pytest
+
+pytest.importorskip('umqtt.robust')
+
+# pylint: disable=wrong-import-position
+from hass_mqtt import Device, Switch
+from hass_mqtt.components import Fingerprints
+
+
+def test_fingerprints_skip_unchanged(tmp_path, make_client):
+    client = make_client()
+    path = str(tmp_path / 'fingerprints.json')
+    device = Device(mqtt_client=client).configure(name='Test', serial_number='test')
+    switch = device.add_component('light', Switch())
+    fingerprints = Fingerprints(path)
+    assert switch.send_config(fingerprints=fingerprints)
+    assert not switch.send_config(fingerprints=fingerprints)
+    assert switch.send_config(fingerprints=fingerprints, force=True)
+    fingerprints.save()
+    assert not switch.send_config(fingerprints=Fingerprints(path))
+
+
+def test_dropped_config_not_recorded(make_client):
+    client = make_client()
+    outbox = client.enable_outbox(maxsize=1)
+    device = Device(mqtt_client=client).configure(name='Test', serial_number='test')
+    switch = device.add_component('light', Switch())
+    fingerprints = Fingerprints()
+    assert client.publish(b'test/filler', b'1')
+    assert outbox.full()
+    assert not switch.send_config(fingerprints=fingerprints)
+    assert outbox.dropped == 1
+    assert not fingerprints.data
+    outbox.take()
+    assert switch.send_config(fingerprints=fingerprints)
+    assert len(fingerprints.data) == 1
@@ -0,0 +1,120 @@
+"""building devices from a description, and its cache"""
+import pytest
+
+pytest.importorskip('umqtt.robust')
+
+# pylint: disable=wrong-import-position
+from hass_mqtt import MQTTClient
+from hass_mqtt import fleet as fleet_module, serializer
+from hass_mqtt.fleet import Fleet
+
+
+def describe(count=3, shard_size=None):
+    """a description of count devices"""
+    devices = []
+    for i in range(count):
+        desc = {
+            'device': {'name': f'Room {i}', 'serial_number': f'room{i}', 'manufacturer': 'me',
+                       'configuration_url': 'http://localhost'},
+            'components': {
+                'temperature': {'type': 'temperature', 'deadband': 0.1, 'read_interval': 5},
+                'humidity': {'type': 'humidity', 'shard': 'climate'},
+                'light': {'type': 'switch', 'name': 'Light', 'data': {'icon': 'mdi:lamp'}},
+                'uptime': {'type': 'diagnostic', 'timeout': 2},
+            },
+        }
+        if shard_size is not None:
+            desc['shard_size'] = shard_size
+        devices.append(desc)
+    return {'devices': devices}
+
+
+def make_fleet(data, cache_path=None):
+    """a fleet of a description"""
+    fleet = Fleet(cache_path=cache_path)
+    fleet.data = data
+    return fleet
+
+
+def resolved(devices):
+    """everything derived from a description"""
+    result = []
+    for device in devices:
+        result.append({
+            'device': device.data,
+            'topics': (device.state_topic, device.command_topic, device.availability_topic),
+            'shards': {name: (shard.state_topic, shard.keys) for name, shard in device.shards.items()},
+            'configs': {key: target.make_config() for key, target in device.components.items()},
+            'settings': {key: (target.deadband, target.read_interval, target.timeout)
+                         for key, target in device.components.items()},
+        })
+    return result
+
+
+@pytest.mark.parametrize('shard_size', [None, 2])
+def test_cache_round_trip(tmp_path, shard_size):
+    cache_path = str(tmp_path / 'cache.json')
+    data = describe(shard_size=shard_size)
+    fleet = make_fleet(data, cache_path)
+    built = fleet.build()
+    assert not fleet.cache_hit
+    fleet = make_fleet(data, cache_path)
+    cached = fleet.build()
+    assert fleet.cache_hit
+    assert resolved(cached) == resolved(built)
+    assert resolved(built) == resolved(make_fleet(data).build())
+
+
+def test_cache_invalidated(tmp_path):
+    cache_path = str(tmp_path / 'cache.json')
+    make_fleet(describe(), cache_path).build()
+    changed = describe()
+    changed['devices'][0]['components']['light']['name'] = 'Lamp'
+    fleet = make_fleet(changed, cache_path)
+    devices = fleet.build()
+    assert not fleet.cache_hit
+    assert devices[0].components['light'].name == 'Lamp'
+    # a status topic is part of the discovery configs
+    client = MQTTClient()
+    client.status_topic = 'gateway/status'
+    fleet = make_fleet(changed, cache_path)
+    fleet.build(client)
+    assert not fleet.cache_hit
+    fleet = make_fleet(changed, cache_path)
+    fleet.build(client)
+    assert fleet.cache_hit
+
+
+def test_cache_invalidated_by_code(tmp_path, monkeypatch):
+    cache_path = str(tmp_path / 'cache.json')
+    make_fleet(describe(), cache_path).build()
+    monkeypatch.setattr(fleet_module, '__version__', '0.0.0')
+    fleet = make_fleet(describe(), cache_path)
+    fleet.build()
+    assert not fleet.cache_hit
+    monkeypatch.setattr(serializer, 'backend', 'other')
+    fleet = make_fleet(describe(), cache_path)
+    fleet.build()
+    assert not fleet.cache_hit
+    fleet = make_fleet(describe(), cache_path)
+    fleet.build()
+    assert fleet.cache_hit
+
+
+def test_broken_cache(tmp_path):
+    cache_path = tmp_path / 'cache.json'
+    cache_path.write_text('{not json')
+    fleet = make_fleet(describe(), str(cache_path))
+    assert len(fleet.build()) == 3
+    assert not fleet.cache_hit
+
+
+@pytest.mark.parametrize('mutate, message', [
+    (lambda data: data['devices'][0]['components']['light'].update(type='lamp'), 'unknown type'),
+    (lambda data: data['devices'][0]['components']['light'].update(data=[]), 'object is required'),
+])
+def test_validate(mutate, message):
+    data = describe()
+    mutate(data)
+    with pytest.raises(ValueError, match=message):
+        make_fleet(data).validate()
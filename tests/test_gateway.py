@@ -0,0 +1,75 @@
+"""assignment and supervision of worker processes"""
+import time
+
+import pytest
+
+pytest.importorskip('umqtt.robust')
+
+# pylint: disable=wrong-import-position
+from hass_mqtt import MQTTInfo
+from hass_mqtt.fleet import Fleet
+from hass_mqtt.gateway import Gateway, assign
+
+
+def describe(serial):
+    """the description of a device with a switch"""
+    return {'device': {'name': serial, 'serial_number': serial}, 'components': {'light': {'type': 'switch'}}}
+
+
+def make_fleet(serials):
+    """a fleet of devices"""
+    fleet = Fleet()
+    fleet.data = {'devices': [describe(serial) for serial in serials]}
+    return fleet
+
+
+def serials(shard):
+    """serial numbers of a shard"""
+    return [desc['device']['serial_number'] for desc in shard]
+
+
+def poison(devices, mqtt_client):  # pylint: disable=unused-argument
+    """crash the worker running the poison device"""
+    for device in devices:
+        if device.serial_number == 'poison':
+            raise RuntimeError('poison device')
+
+
+def test_assign_stable():
+    descriptions = [describe(f'd{i}') for i in range(50)]
+    shards = assign(descriptions, [0, 1, 2, 3])
+    assert sum(len(shard) for shard in shards.values()) == 50
+    assert all(shards.values())
+    # removing a worker only moves its own devices
+    fewer = assign(descriptions, [0, 1, 3])
+    for worker_id in (0, 1, 3):
+        assert set(serials(shards[worker_id])) <= set(serials(fewer[worker_id]))
+    assert assign(descriptions, []) == {}
+
+
+def test_quarantine(broker):
+    names = [f'd{i}' for i in range(8)] + ['poison']
+    info = MQTTInfo().prop('addr', broker.host).prop('port', broker.port).prop('client_id', 'gw')
+    gateway = Gateway(info, make_fleet(names), workers=3, setup=poison, report_interval=0.2,
+                      max_restarts=1, restart_delay=0, start_method='fork')
+    shards = {worker_id: serials(worker.shard) for worker_id, worker in gateway.workers.items()}
+    bad = next(worker_id for worker_id, shard in shards.items() if 'poison' in shard)
+    gateway.start()
+    try:
+        deadline = time.monotonic() + 20
+        while not gateway.workers[bad].failed and time.monotonic() < deadline:
+            gateway.check()
+            time.sleep(0.05)
+        assert gateway.workers[bad].failed
+        gateway.check()
+        # the others keep their devices and keep running
+        for worker_id, worker in gateway.workers.items():
+            assert serials(worker.shard) == shards[worker_id]
+            if worker_id != bad:
+                assert worker.alive()
+        assert set(gateway.quarantined()) == set(shards[bad])
+        health = gateway.health()
+        assert health['totals']['quarantined'] == len(shards[bad])
+        assert health['workers'][bad]['failed']
+    finally:
+        gateway.stop()
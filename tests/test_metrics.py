@@ -0,0 +1,25 @@
+"""metrics and their diagnostic sensors"""
+import pytest
+
+pytest.importorskip('umqtt.robust')
+
+# pylint: disable=wrong-import-position
+from hass_mqtt import Device
+from hass_mqtt.components.sensor import Diagnostic
+from hass_mqtt.metrics import Metrics
+
+
+def test_metric_sensors():
+    metrics = Metrics()
+    device = Device().configure(name='Test', serial_number='test')
+    device.add_metric_sensors(metrics)
+    assert isinstance(device.components['mqtt_messages_in'], Diagnostic)
+    assert device.components['mqtt_bytes_in'].unit_of_measurement == 'B'
+    stats = metrics.topic(b'test/x')
+    stats.count += 2
+    stats.bytes_in += 10
+    stats.latency.observe(0.002)
+    metrics.update_sensors()
+    assert device.value['mqtt_messages_in'] == 2
+    assert device.value['mqtt_bytes_in'] == 10
+    assert device.value['mqtt_latency_p95'] == 0.005
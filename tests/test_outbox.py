@@ -0,0 +1,76 @@
+"""the outbox against the fake broker"""
+import asyncio
+
+import pytest
+
+pytest.importorskip('umqtt.robust')
+
+# pylint: disable=wrong-import-position
+from hass_mqtt.packet import publish_packet
+from hass_mqtt.ratelimit import COMMAND, HEARTBEAT
+
+
+def run(coro):
+    """run a coroutine with a timeout"""
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+def test_priority_and_coalesce(make_client):
+    client = make_client()
+    outbox = client.enable_outbox()
+    outbox.put(b'test/heartbeat', b'1', priority=HEARTBEAT)
+    outbox.put(b'test/state', b'old', coalesce=True)
+    outbox.put(b'test/state', b'new', coalesce=True)
+    outbox.put(b'test/cmd', b'on', priority=COMMAND)
+    assert outbox.depth == 3
+    assert outbox.take() == (
+        publish_packet(b'test/cmd', b'on') + publish_packet(b'test/state', b'new')
+        + publish_packet(b'test/heartbeat', b'1')
+    )
+    assert outbox.depth == 0
+    assert outbox.coalesced == 1
+
+
+def test_failed_write_reconnects(broker, make_client):
+    client = make_client()
+    outbox = client.enable_outbox()
+    old = client.client.sock
+    for i in range(3):
+        outbox.put(b'test/state', str(i).encode())
+    outbox.put(b'test/latest', b'1', coalesce=True)
+    client.client.sock.close()
+    broker.expect(4)
+    run(outbox.flush())
+    assert broker.wait(5)
+    assert client.client.sock is not old
+    assert outbox.errors == 1
+    assert outbox.sent == 4
+    assert outbox.depth == 0
+    assert not outbox.latest
+
+
+def test_failed_write_hands_off_to_spool(tmp_path, broker, make_client):
+    client = make_client()
+    client.enable_spool(str(tmp_path / 'spool'), rate=1000, retry_delay=0)
+    outbox = client.set_rate_limit(1000)
+    for i in range(3):
+        assert client.publish(b'test/state', str(i).encode())
+    assert outbox.depth == 3
+    client.client.sock.close()
+    run(outbox.flush())
+    assert outbox.errors == 1
+    assert outbox.depth == 0
+    assert len(client.spool) == 3
+    assert not client.connected
+    # stored in order while disconnected, skipping the outbox
+    assert client.publish(b'test/state', b'3')
+    assert len(client.spool) == 4
+    broker.expect(4)
+
+    async def restore():
+        assert await client.restore()
+        await client.draining
+
+    run(restore())
+    assert broker.wait(5)
+    assert not len(client.spool)
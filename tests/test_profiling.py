@@ -0,0 +1,32 @@
+"""tracers around commands and writes"""
+import asyncio
+
+import pytest
+
+pytest.importorskip('umqtt.robust')
+
+# pylint: disable=wrong-import-position
+from hass_mqtt import Device, Switch
+from hass_mqtt.profiling import SpanTracer
+
+
+def test_command_and_write_spans(make_client):
+    client = make_client()
+    device = Device(mqtt_client=client).configure(name='Test', serial_number='test')
+    switch = device.add_component('light', Switch())
+    written = []
+
+    async def writer(msg):
+        written.append(msg)
+
+    switch.set_writer(writer)
+    tracer = client.tracer = SpanTracer()
+
+    async def main():
+        device.on_command(b'light;ON')
+        await asyncio.gather(*switch.write_tasks)
+
+    asyncio.run(main())
+    assert written == [b'ON']
+    assert tracer.spans['command test_light'].count == 1
+    assert tracer.spans['write test_light'].count == 1
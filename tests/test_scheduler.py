@@ -0,0 +1,52 @@
+"""the shared scheduler"""
+import asyncio
+import gc
+
+from hass_mqtt.scheduler import Scheduler
+
+
+def test_align():
+    scheduler = Scheduler(tick=0.5)
+    assert scheduler.align(1.0) == 1.0
+    assert scheduler.align(1.1) == 1.5
+    assert Scheduler(tick=0).align(1.1) == 1.1
+
+
+def test_errors_do_not_stop_others():
+    scheduler = Scheduler(tick=0)
+    calls = []
+    bad = scheduler.every(1, lambda: 1 / 0)
+    scheduler.every(1, lambda: calls.append(1))
+    assert scheduler.run_pending(now=10**9) == 2
+    assert calls == [1]
+    assert bad.errors == 1
+    assert isinstance(bad.last_error, ZeroDivisionError)
+
+
+def test_async_job_kept_until_done():
+    scheduler = Scheduler(tick=0)
+    done = []
+
+    async def job_func():
+        await asyncio.sleep(0.01)
+        gc.collect()
+        await asyncio.sleep(0.01)
+        done.append(1)
+
+    async def main():
+        job = scheduler.every(1, job_func)
+        scheduler.run_pending()
+        assert job.running
+        assert job.task is not None
+        # skipped while the last run is pending
+        scheduler.run_job(job)
+        assert job.runs == 1
+        await asyncio.sleep(0)
+        gc.collect()
+        await asyncio.sleep(0.05)
+        return job
+
+    job = asyncio.run(main())
+    assert done == [1]
+    assert not job.running
+    assert job.task is None
@@ -0,0 +1,33 @@
+"""sensors"""
+import pytest
+
+pytest.importorskip('umqtt.robust')
+
+# pylint: disable=wrong-import-position
+from hass_mqtt.components import sensor
+
+
+def test_aggregate_exact_samples():
+    aggregate = sensor.Aggregate().set_capacity(8)
+    for sample in (20.1, 21.3, 20.7, 21.3):
+        aggregate.add_sample(sample)
+    summary = aggregate.summarize()
+    assert summary['max'] == 21.3
+    assert summary['p95'] == 21.3
+    assert summary['p50'] == 21.3
+    assert summary['min'] <= summary['p50'] <= summary['p95'] <= summary['max']
+    assert aggregate.value == pytest.approx((20.1 + 21.3 + 20.7 + 21.3) / 4)
+
+
+def test_aggregate_ring():
+    aggregate = sensor.Aggregate().set_capacity(4)
+    for sample in range(10):
+        aggregate.add_sample(float(sample))
+    summary = aggregate.summarize()
+    # min, max and count cover the window, percentiles the kept samples
+    assert summary['min'] == 0.0
+    assert summary['max'] == 9.0
+    assert summary['count'] == 10
+    assert summary['p50'] in (7.0, 8.0)
+    assert not aggregate.count
+    assert aggregate.summarize() == summary
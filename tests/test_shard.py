@@ -0,0 +1,93 @@
+"""state sub-topics of devices"""
+import json
+
+import pytest
+
+pytest.importorskip('umqtt.robust')
+
+# pylint: disable=wrong-import-position
+from hass_mqtt import Device, Switch
+from hass_mqtt.components import sensor
+
+
+def make_device(mqtt_client=None, shard_size=2, count=5):
+    """a device with count temperatures in automatic shards and a switch in an explicit one"""
+    device = Device(mqtt_client=mqtt_client).configure(name='Test', serial_number='test')
+    device.set_sharding(shard_size)
+    for i in range(count):
+        device.add_component(f't{i}', sensor.Temperature())
+    device.add_component('light', Switch(), shard='controls')
+    return device
+
+
+def test_layout():
+    device = make_device()
+    assert {name: shard.keys for name, shard in device.shards.items()} == {
+        '0': ['t0', 't1'], '1': ['t2', 't3'], '2': ['t4'], 'controls': ['light'],
+    }
+    assert device.shards['1'].state_topic == 'device/test/get/1'
+    target = device.components['t3']
+    assert target.state_topic == 'device/test/get/1'
+    assert json.loads(target.make_config()[1])['value_template'] == '{{ value_json.t3 }}'
+    assert device.component_shards['t3'] is device.shards['1']
+    # a shard only carries the values of its components
+    target.value = 21.5
+    default = device.components['t2'].value
+    assert json.loads(device.shards['1'].encoder.encode(device.shards['1'].value)) == {'t2': default, 't3': 21.5}
+    assert not device.value
+    assert device.holders() == list(device.shards.values())
+
+
+def test_unsharded_components_stay_on_the_device():
+    device = Device().configure(name='Test', serial_number='test')
+    device.add_component('a', sensor.Temperature())
+    device.add_component('b', sensor.Temperature(), shard='extra')
+    assert device.components['a'].state_topic == 'device/test/get'
+    assert device.components['b'].state_topic == 'device/test/get/extra'
+    assert device.holders() == [device, device.shards['extra']]
+    assert 'a' in device.value and 'b' not in device.value
+
+
+def test_config_topics():
+    device = make_device()
+    topic, payload, _ = device.components['light'].make_config()
+    data = json.loads(payload)
+    assert topic.endswith('/config')
+    assert data['state_topic'] == 'device/test/get/controls'
+    assert data['command_topic'] == 'device/test/set'
+    assert data['command_template'] == 'light;{{ value }}'
+
+
+def test_delta_push_changed_shard(broker, make_client):
+    client = make_client()
+    device = make_device(client)
+    device.set_delta()
+    default = device.components['t3'].value
+    broker.expect(4)
+    assert device.push_state()
+    assert broker.wait(5)
+    assert not device.push_state()
+    device.components['t2'].value = 20.0
+    received = broker.received
+    broker.expect(1)
+    assert device.push_state()
+    assert broker.wait(5)
+    assert broker.received == received + 1
+    assert device.shards['1'].last_state == {'t2': 20.0, 't3': default}
+
+
+def test_echo_pushes_the_shard(broker, make_client):
+    client = make_client()
+    device = make_device(client)
+    device.set_delta()
+    broker.expect(4)
+    device.push_state()
+    assert broker.wait(5)
+    switch = device.components['light']
+    received = broker.received
+    broker.expect(1)
+    device.on_command(b'light;ON')
+    assert broker.wait(5)
+    assert switch.value == 'ON'
+    assert broker.received == received + 1
+    assert device.echo_stats.count == 1
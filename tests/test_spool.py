@@ -0,0 +1,136 @@
+"""the on-disk spool and store and forward"""
+import asyncio
+
+from hass_mqtt.spool import Spool, RECORD
+
+
+def drain(spool):
+    """pop all messages"""
+    messages = []
+    while True:
+        item = spool.peek()
+        if item is None:
+            return messages
+        messages.append(item[0])
+        spool.advance(item[1])
+
+
+def test_wraparound(tmp_path):
+    size = RECORD.size + len(b'topic') + 10
+    spool = Spool(str(tmp_path / 'spool'), capacity=size * 3 + 7)
+    for i in range(3):
+        assert spool.append(b'topic', b'%010d' % i)
+    spool.advance(spool.peek()[1])
+    # the next record crosses the end of the ring
+    assert spool.append(b'topic', b'%010d' % 3, retain=True, qos=1)
+    assert spool.head % spool.capacity < spool.tail % spool.capacity
+    messages = drain(spool)
+    assert [msg for _, msg, _, _ in messages] == [b'%010d' % i for i in (1, 2, 3)]
+    assert messages[-1] == (b'topic', b'0000000003', True, 1)
+    spool.close()
+
+
+def test_drop_oldest_when_full(tmp_path):
+    size = RECORD.size + len(b't') + 4
+    spool = Spool(str(tmp_path / 'spool'), capacity=size * 2)
+    for i in range(5):
+        assert spool.append(b't', b'%04d' % i)
+    assert spool.dropped == 3
+    assert [msg for _, msg, _, _ in drain(spool)] == [b'0003', b'0004']
+    assert not spool.append(b't', b'x' * spool.capacity)
+    spool.close()
+
+
+def test_reopen(tmp_path):
+    path = str(tmp_path / 'spool')
+    spool = Spool(path, capacity=1024)
+    spool.append('a/b', b'1')
+    spool.append('a/b', b'2')
+    spool.close()
+    spool = Spool(path, capacity=1024)
+    assert len(spool) == 2
+    assert [msg for _, msg, _, _ in drain(spool)] == [b'1', b'2']
+    spool.close()
+
+
+def test_drain_on_connect(tmp_path, broker, make_client):
+    path = str(tmp_path / 'spool')
+    spool = Spool(path)
+    for i in range(5):
+        spool.append(b'test/state', str(i).encode())
+    spool.close()
+
+    async def main():
+        client = make_client(connect=False)
+        client.enable_spool(path, rate=1000, batch=2)
+        broker.expect(5)
+        client.connect(clean_session=True)
+        assert client.draining is not None
+        await client.draining
+        return client
+
+    client = asyncio.run(main())
+    assert broker.wait(5)
+    assert len(client.spool) == 0
+
+
+def test_drain_after_loop_starts(tmp_path, broker, make_client):
+    client = make_client(connect=False)
+    client.enable_spool(str(tmp_path / 'spool'), rate=1000)
+    client.spool.append(b'test/state', b'stored')
+    broker.expect(1)
+    client.connect(clean_session=True)
+    assert client.draining is None
+
+    async def main():
+        task = asyncio.create_task(client.loop(0.01))
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(main())
+    assert broker.wait(5)
+    assert len(client.spool) == 0
+
+
+def test_restore(tmp_path, broker, make_client):
+    client = make_client()
+    client.enable_spool(str(tmp_path / 'spool'), rate=1000, retry_delay=0)
+    client.lost()
+    assert client.publish(b'test/state', b'offline message')
+    assert len(client.spool) == 1
+    broker.expect(1)
+
+    async def main():
+        assert await client.restore()
+        await client.draining
+
+    asyncio.run(main())
+    assert broker.wait(5)
+    assert client.connected
+
+
+def test_announce_before_backlog(tmp_path, monkeypatch, broker, make_client):
+    topics = []
+    on_publish = broker.on_publish
+
+    def record(sender, header, body):
+        topics.append(body[2:2 + int.from_bytes(body[:2], 'big')])
+        on_publish(sender, header, body)
+
+    monkeypatch.setattr(broker, 'on_publish', record)
+    client = make_client(status_topic='gw/status')
+    client.enable_spool(str(tmp_path / 'spool'), rate=1000, retry_delay=0)
+    client.lost()
+    for i in range(3):
+        client.publish(b'test/state', str(i).encode())
+    assert len(client.spool) == 3
+    del topics[:]
+    broker.expect(4)
+
+    async def main():
+        assert await client.restore()
+        await client.draining
+
+    asyncio.run(main())
+    assert broker.wait(5)
+    assert topics == [b'gw/status'] + [b'test/state'] * 3
@@ -0,0 +1,116 @@
+"""batched subscriptions and SUBACKs"""
+import asyncio
+import io
+from types import SimpleNamespace
+
+import pytest
+
+from hass_mqtt.packet import SUBACK, SUBSCRIBE, encode_length, subscribe_packet
+from benchmarks.broker import Handler
+
+
+def reading(data):
+    """a client whose socket reads data"""
+    pytest.importorskip('umqtt.robust')
+    from hass_mqtt import MQTTClient  # pylint: disable=import-outside-toplevel
+    client = MQTTClient()
+    client.client = SimpleNamespace(sock=io.BytesIO(data))
+    return client
+
+
+def test_subscribe_packet():
+    packet = subscribe_packet(0x1234, [b'a/b', 'c/#'], qos=1)
+    assert packet[0] == SUBSCRIBE
+    assert packet[1:2] == encode_length(len(packet) - 2)
+    assert packet[2:] == b'\x12\x34\x00\x03a/b\x01\x00\x03c/#\x01'
+
+
+def test_long_subscribe_packet():
+    topics = [b'topic/%03d' % i for i in range(64)]
+    packet = subscribe_packet(1, topics)
+    size = 2 + 64 * (2 + 9 + 1)
+    assert packet[1:3] == encode_length(size)
+    assert len(encode_length(size)) == 2
+    assert len(packet) == 3 + size
+
+
+def test_suback():
+    body = b'\x00\x07\x00\x80\x01'
+    client = reading(encode_length(len(body)) + body)
+    client.pending_subacks[7] = [b'a', b'b', b'c']
+    client.pending_subacks[8] = [b'd']
+    assert client.handle_op(SUBACK) == SUBACK
+    assert client.rejected == [b'b']
+    assert list(client.pending_subacks) == [8]
+
+
+def test_unknown_suback():
+    body = b'\x00\x09\x00'
+    client = reading(encode_length(len(body)) + body)
+    client.handle_op(SUBACK)
+    assert not client.rejected
+
+
+def test_batches(broker, make_client):
+    client = make_client()
+    client.subscribe_batch = 3
+    client.hold_subscriptions()
+    for i in range(7):
+        client.subscribe(f'test/{i}', lambda msg: None)
+    assert len(client.unsent) == 7
+    client.flush_subscriptions()
+    assert not client.pending_subacks
+    assert not client.unsent
+    assert len(broker.subscriptions) == 7
+
+
+def test_suback_timeout(monkeypatch, make_client):
+    client = make_client()
+    client.subscribe_timeout = 0.2
+    monkeypatch.setattr(Handler, 'on_subscribe', lambda self, body: None)
+    client.subscribe('test/cmd', lambda msg: None)
+    assert len(client.pending_subacks) == 1
+
+
+def test_reconnect_while_waiting(monkeypatch, broker, make_client):
+    on_subscribe = Handler.on_subscribe
+    dropped = []
+
+    def drop_once(self, body):
+        if not dropped:
+            dropped.append(body)
+            self.request.close()
+            return
+        on_subscribe(self, body)
+
+    client = make_client()
+    old = client.client.sock
+    monkeypatch.setattr(Handler, 'on_subscribe', drop_once)
+    client.subscribe('test/cmd', lambda msg: None)
+    assert dropped
+    assert client.client.sock is not old
+    assert not client.pending_subacks
+    assert b'test/cmd' in broker.subscriptions
+
+
+def test_subscribe_on_broken_socket(broker, make_client):
+    client = make_client()
+    client.client.sock.close()
+    client.subscribe('test/cmd', lambda msg: None)
+    assert not client.pending_subacks
+    assert b'test/cmd' in broker.subscriptions
+
+
+def test_subscribe_on_broken_socket_with_spool(tmp_path, broker, make_client):
+    client = make_client()
+    client.enable_spool(str(tmp_path / 'spool'), retry_delay=0)
+    client.client.sock.close()
+    client.subscribe('test/cmd', lambda msg: None)
+    assert not client.connected
+
+    async def main():
+        assert await client.restore()
+
+    asyncio.run(main())
+    assert not client.pending_subacks
+    assert b'test/cmd' in broker.subscriptions
@@ -0,0 +1,76 @@
+"""topic filters and the topic trie"""
+import pytest
+
+from hass_mqtt.topic import TopicTrie
+
+
+def reference(topic_filter, topic):
+    """match a topic against a filter level by level, as MQTT 3.1.1 specifies"""
+    if topic[:1] == b'$' and topic_filter[:1] in (b'+', b'#'):
+        return False
+    levels = topic.split(b'/')
+    filters = topic_filter.split(b'/')
+    for i, level in enumerate(filters):
+        if level == b'#':
+            return True
+        if i >= len(levels):
+            return False
+        if level != b'+' and level != levels[i]:
+            return False
+    return len(filters) == len(levels)
+
+
+FILTERS = [b'a/b', b'a/+', b'a/#', b'+/b', b'#', b'+/+/c', b'a/+/#', b'$SYS/#', b'$SYS/+', b'a/b/c', b'+']
+TOPICS = [b'a', b'a/b', b'a/c', b'a/b/c', b'b/b', b'x/y/c', b'$SYS/load', b'$SYS', b'a/b/c/d', b'', b'/b']
+
+
+def make_trie():
+    """a trie whose callback lists name their filters"""
+    trie = TopicTrie()
+    for topic_filter in FILTERS:
+        trie.insert(topic_filter, [topic_filter])
+    return trie
+
+
+@pytest.mark.parametrize('topic', TOPICS)
+def test_match(topic):
+    found = sorted(cbs[0] for cbs in make_trie().match(topic))
+    assert found == sorted(x for x in FILTERS if reference(x, topic))
+
+
+def test_remove():
+    trie = make_trie()
+    assert len(trie) == len(FILTERS)
+    for topic_filter in FILTERS:
+        trie.remove(topic_filter)
+    trie.remove(b'not/+/there')
+    assert len(trie) == 0
+    assert trie.root.is_empty()
+    assert not any(trie.match(topic) for topic in TOPICS)
+
+
+def test_shared_list():
+    trie = TopicTrie()
+    cbs = trie.insert(b'a/+', [])
+    cbs.append(1)
+    assert trie.match(b'a/x') == [[1]]
+
+
+@pytest.mark.parametrize('topic_filter', [b'a/#/b', b'a/b+', b'a#'])
+def test_invalid(topic_filter):
+    with pytest.raises(ValueError):
+        TopicTrie().insert(topic_filter, [])
+
+
+def test_client_dispatch():
+    pytest.importorskip('umqtt.robust')
+    from hass_mqtt import MQTTClient  # pylint: disable=import-outside-toplevel
+    client = MQTTClient()
+    received = []
+    client.subscribe('device/+/set', lambda msg: received.append(('plus', msg)))
+    client.subscribe('device/#', lambda msg: received.append(('hash', msg)))
+    client.subscribe('device/a/set', lambda msg: received.append(('exact', msg)))
+    client.sub_cb(b'device/a/set', b'1')
+    client.sub_cb(b'other/a/set', b'2')
+    assert sorted(received) == [('exact', b'1'), ('hash', b'1'), ('plus', b'1')]
+    assert client.metrics.topic(b'device/a/set').count == 1
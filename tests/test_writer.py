@@ -0,0 +1,60 @@
+"""writers of components"""
+import asyncio
+
+import pytest
+
+pytest.importorskip('umqtt.robust')
+
+# pylint: disable=wrong-import-position
+import hass_mqtt
+from hass_mqtt import Switch
+
+
+def test_executor_module():
+    assert hass_mqtt.executor.Executor is not None
+    assert isinstance(hass_mqtt.executor.default_executor, hass_mqtt.executor.Executor)
+
+
+def test_blocking_writer_without_loop():
+    switch = Switch()
+    written = []
+    switch.set_writer(lambda msg: written.append(msg) or 'done', blocking=True)
+    assert switch.write(b'ON') == 'done'
+    assert written == [b'ON']
+
+
+def test_async_writer_without_loop():
+    switch = Switch()
+    written = []
+
+    async def writer(msg):
+        written.append(msg)
+
+    switch.set_writer(writer)
+    switch.write(b'ON')
+    assert written == [b'ON']
+
+
+def test_writers_in_order():
+    switch = Switch()
+    written = []
+
+    async def writer(msg):
+        await asyncio.sleep(0.01 if msg == b'1' else 0)
+        written.append(msg)
+
+    async def main():
+        switch.set_writer(writer)
+        tasks = [switch.write(str(i).encode()) for i in range(3)]
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert written == [b'0', b'1', b'2']
+
+
+def test_blocking_reader():
+    switch = Switch()
+    switch.set_reader(lambda: setattr(switch, 'value', 'ON'), blocking=True)
+    assert switch.read_blocking
+    asyncio.run(switch.read())
+    assert switch.value == 'ON'